@@ -1,43 +1,288 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, ttk as bootttk # Use alias for clarity
 import socket
+import sys
+import select
 import os
+import json
+import struct
+import stat
 import ttkbootstrap as ttk # Main theme provider
 import zipfile
-import tempfile
-import traceback # For logging unexpected client errors
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
+import time
+import logging
+
+log = logging.getLogger("client")
+LOG_LEVEL = os.environ.get("LOGLEVEL", "INFO").upper() # LOGLEVEL=DEBUG shows per-step protocol chatter
+LOG_LEVEL_VALID = isinstance(logging.getLevelName(LOG_LEVEL), int) # An unknown name would make basicConfig() raise and the GUI never start
+logging.basicConfig(level=LOG_LEVEL if LOG_LEVEL_VALID else logging.WARNING, format="%(message)s")
+if not LOG_LEVEL_VALID: log.warning("Unknown LOGLEVEL %r, logging at WARNING instead.", os.environ["LOGLEVEL"])
 
 # Dependencies for Client: ttkbootstrap
 # Dependencies for Server: Pillow, comtypes-client, pypdf, PyMuPDF,
 #                          pdf2docx, python-pptx, reportlab
 #                          (and MS Office if DOCX/PPTX/XLSX/HTML to PDF needed)
 
+# --- Protocol Helpers ---
+CHUNKED_SIZE = -1 # Header "size" for a chunked body: [!I length][data] chunks, ended by a zero length
+CHUNKED_RESULT_SIZE = 0xFFFFFFFFFFFFFFFF # Result "size" (!Q) for chunked result data, same framing
+TCP_FASTOPEN_CONNECT = getattr(socket, "TCP_FASTOPEN_CONNECT", 30) # Linux 4.11+ (linux/tcp.h), not exported by every Python
+
+def _control_frame(action):
+    """Encodes a body-less request ([!I length][JSON header]) for a connection-level action."""
+    header = json.dumps({"action": action}).encode()
+    return struct.pack("!I", len(header)) + header
+
+# Constant frames, encoded once instead of on every use
+PING_FRAME = _control_frame("ping")
+BYE_FRAME = _control_frame("bye")
+PONG = b"PONG"
+END_CHUNK = struct.pack("!I", 0) # Zero-length chunk: end of chunked data
+
+def _recv_exact(sock, n):
+    """Receives exactly n bytes or raises ConnectionAbortedError."""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if not count: raise ConnectionAbortedError(f"Server disconnected mid-message ({received}/{n} bytes received).")
+        received += count
+    return bytes(buf)
+
+def _copy_exact(src, dst, size, chunk_size, progress=None):
+    """Copies exactly size bytes from src to dst, overlapping reads and writes.
+
+    Like shutil.copyfileobj(), but bounded to size and using readinto() into two
+    reused buffers: while one is written to dst by a helper thread, the next is
+    filled from src. size None copies until src is exhausted. progress(copied)
+    is called after each chunk if given. Returns the number of bytes copied.
+    """
+    free_views, filled_views = queue.Queue(), queue.Queue()
+    for _ in range(2): free_views.put(memoryview(bytearray(chunk_size)))
+    write_errors = []
+
+    def writer():
+        while True:
+            item = filled_views.get()
+            if item is None: return
+            view, count = item
+            try:
+                if not write_errors: dst.write(view[:count])
+            except Exception as e: write_errors.append(e)
+            finally: free_views.put(view)
+
+    writer_thread = threading.Thread(target=writer, name="copy-writer", daemon=True)
+    writer_thread.start()
+    copied = 0
+    try:
+        while size is None or copied < size:
+            if write_errors: break
+            view = free_views.get()
+            count = src.readinto(view[:chunk_size if size is None else min(chunk_size, size - copied)])
+            if not count and size is None: break # End of an unsized source
+            if not count: raise ConnectionAbortedError(f"Server disconnected during result transfer ({copied}/{size} received).")
+            filled_views.put((view, count))
+            copied += count
+            if progress: progress(copied)
+    finally:
+        filled_views.put(None) # Let the writer drain and stop
+        writer_thread.join()
+    if write_errors: raise write_errors[0]
+    return copied
+
+def _sendall_buffers(sock, buffers):
+    """Sends buffers back to back, like sendall(b"".join(buffers)) but without the join where sendmsg() exists:
+    the kernel gathers them (writev-style), so a small header and a large chunk need neither a copy nor two sends."""
+    if not hasattr(sock, "sendmsg"): # Windows
+        sock.sendall(b"".join(buffers))
+        return
+    views = [memoryview(b).cast("B") for b in buffers if len(b)]
+    while views:
+        sent = sock.sendmsg(views) # May be partial, like send()
+        while sent:
+            if sent >= len(views[0]): sent -= len(views[0]); views.pop(0)
+            else: views[0] = views[0][sent:]; sent = 0
+
+class _ChunkedWriter:
+    """Write-only file object that sends data as [!I length][data] chunks on a socket.
+
+    Used for request bodies whose size is not known up front (header size
+    CHUNKED_SIZE). Small writes are gathered into chunk_size chunks; close()
+    sends the zero-length chunk that ends the body.
+    """
+    def __init__(self, sock, chunk_size):
+        self._sock = sock
+        self._chunk_size = chunk_size
+        self._pending = bytearray()
+        self.bytes_sent = 0
+
+    def write(self, data):
+        self._pending += data
+        if len(self._pending) >= self._chunk_size: self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._pending: return
+        _sendall_buffers(self._sock, [struct.pack("!I", len(self._pending)), self._pending]) # Chunk data is not copied again
+        self.bytes_sent += len(self._pending)
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._sock.sendall(END_CHUNK)
+
+class _ChunkedReader:
+    """Read-only file object over [!I length][data] chunks on a socket (result size CHUNKED_RESULT_SIZE).
+
+    readinto() returns 0 once the zero-length chunk that ends the data has
+    been read, leaving the connection at the next message.
+    """
+    def __init__(self, sock):
+        self._sock = sock
+        self._left = 0 # Bytes left in the current chunk
+        self._done = False
+
+    def readinto(self, view):
+        while not self._left:
+            if self._done: return 0
+            self._left = struct.unpack("!I", _recv_exact(self._sock, 4))[0]
+            self._done = not self._left
+        count = self._sock.recv_into(view[:min(len(view), self._left)])
+        if not count: raise ConnectionAbortedError("Server disconnected during chunked result transfer.")
+        self._left -= count
+        return count
+
+# --- Connection Pool (keep-alive across operations) ---
+SOCKET_POOL_MAX_IDLE = 2 # Idle connections kept per server
+SOCKET_POOL_IDLE_TIMEOUT = 30.0 # Seconds; the server drops connections idle for 60s
+_socket_pool = {} # (host, port) -> list of (socket, released_at)
+_socket_pool_lock = threading.Lock()
+
+def _ping(sock):
+    """Checks that a pooled connection is still served (PING frame -> PONG)."""
+    try:
+        sock.settimeout(5.0)
+        sock.sendall(PING_FRAME)
+        return _recv_exact(sock, len(PONG)) == PONG
+    except OSError:
+        return False
+
+def _socket_pool_acquire(address):
+    """Returns a live pooled connection to address, or None if there is none."""
+    while True:
+        with _socket_pool_lock:
+            idle = _socket_pool.get(address)
+            if not idle: return None
+            sock, released_at = idle.pop()
+        if time.monotonic() - released_at < SOCKET_POOL_IDLE_TIMEOUT and _ping(sock):
+            return sock
+        sock.close() # Stale or dead, try the next one
+
+def _socket_pool_release(address, sock):
+    """Returns a connection to the pool, closing it if the pool is full."""
+    with _socket_pool_lock:
+        idle = _socket_pool.setdefault(address, [])
+        now = time.monotonic()
+        expired = [s for s, released_at in idle if now - released_at >= SOCKET_POOL_IDLE_TIMEOUT]
+        idle[:] = [(s, released_at) for s, released_at in idle if now - released_at < SOCKET_POOL_IDLE_TIMEOUT]
+        keep = len(idle) < SOCKET_POOL_MAX_IDLE
+        if keep: idle.append((sock, now))
+    for stale in expired: stale.close()
+    if not keep: sock.close()
+    return keep
+
+def _socket_pool_close_all():
+    """Says goodbye on every idle pooled connection and closes it (at exit), so the server frees them at once."""
+    with _socket_pool_lock:
+        idle = [sock for entries in _socket_pool.values() for sock, _ in entries]
+        _socket_pool.clear()
+    for sock in idle:
+        try: sock.sendall(BYE_FRAME)
+        except OSError: pass # Already gone
+        finally: sock.close()
+
 def client_program():
     HOST = '127.0.0.1'
     PORT = 65432
-
-    # --- Helper Dialogs (Using Toplevel for modality and better widgets) ---
-    def ask_password():
-        dialog = tk.Toplevel(root)
-        dialog.title("Password Required")
-        dialog.geometry("300x120")
-        dialog.transient(root); dialog.grab_set(); dialog.resizable(False, False)
-        ttk.Label(dialog, text="Enter PDF password:").pack(pady=10)
+    SOCKET_BUFFER_SIZE = 4 * 1024 * 1024 # Kernel send/receive buffers, sized for large transfers
+    TRANSFER_CHUNK_SIZE = 1024 * 1024 # Bytes moved per recv_into()/readinto() call in the bulk transfer loops
+    MERGE_READ_WORKERS = 4 # Merge inputs read from disk concurrently
+
+    # --- Helper Dialogs (one reusable Toplevel, one frame per dialog type) ---
+    modal = {} # Filled once by build_modal_dialog(); widgets are reused for every prompt
+
+    def build_modal_dialog():
+        """Creates the hidden dialog window and all its option frames up front."""
+        dialog = tk.Toplevel(root); dialog.withdraw()
+        dialog.transient(root); dialog.resizable(False, False)
+        done_var = tk.BooleanVar(value=False)
+        modal.update(window=dialog, done=done_var, result=None, frames={}, on_ok=None)
+        def close(result): modal["result"] = result; done_var.set(True)
+        dialog.protocol("WM_DELETE_WINDOW", lambda: close(None)) # Window close == Cancel
+        dialog.bind('<Return>', lambda event=None: modal["on_ok"]()) # Bind Enter key to OK
+
+        def add_buttons(frame, on_ok, pady):
+            button_frame = ttk.Frame(frame); button_frame.pack(pady=pady)
+            ttk.Button(button_frame, text="OK", command=on_ok, bootstyle="primary").pack(side=tk.LEFT, padx=10)
+            ttk.Button(button_frame, text="Cancel", command=lambda: close(None)).pack(side=tk.RIGHT, padx=10)
+
+        # Password
+        frame = ttk.Frame(dialog)
+        ttk.Label(frame, text="Enter PDF password:").pack(pady=10)
         password_var = tk.StringVar()
-        password_entry = ttk.Entry(dialog, textvariable=password_var, show='*')
+        password_entry = ttk.Entry(frame, textvariable=password_var, show='*')
         password_entry.pack(pady=5, padx=20, fill=tk.X)
-        password_entry.focus_set()
-        result = {"password": None}
-        def on_ok(): result["password"] = password_var.get(); dialog.destroy()
-        def on_cancel(): dialog.destroy()
-        button_frame = ttk.Frame(dialog)
-        ttk.Button(button_frame, text="OK", command=on_ok, bootstyle="primary").pack(side=tk.LEFT, padx=10)
-        ttk.Button(button_frame, text="Cancel", command=on_cancel).pack(side=tk.RIGHT, padx=10)
-        button_frame.pack(pady=10)
-        # Bind Enter key to OK
-        dialog.bind('<Return>', lambda event=None: on_ok())
-        root.wait_window(dialog)
-        return result["password"] # None if cancelled
+        on_ok = lambda: close({"password": password_var.get()})
+        add_buttons(frame, on_ok, pady=10)
+        modal["frames"]["password"] = dict(frame=frame, title="Password Required", geometry="300x120", focus=password_entry,
+            on_ok=on_ok, reset=lambda: password_var.set(""))
+
+        # Rotate Options
+        frame = ttk.Frame(dialog)
+        ttk.Label(frame, text="Pages to rotate (e.g., 1, 3-5, all):").pack(pady=5, padx=10, anchor='w')
+        pages_var = tk.StringVar()
+        pages_entry = ttk.Entry(frame, textvariable=pages_var)
+        pages_entry.pack(pady=2, padx=10, fill=tk.X)
+        ttk.Label(frame, text="Rotation angle:").pack(pady=5, padx=10, anchor='w')
+        angle_var = tk.IntVar()
+        bootttk.Combobox(frame, textvariable=angle_var, values=[90, 180, 270, -90], state="readonly", width=10).pack(pady=2, padx=10)
+        on_ok = lambda: close({"pages": pages_var.get(), "angle": angle_var.get()})
+        add_buttons(frame, on_ok, pady=15)
+        modal["frames"]["rotate"] = dict(frame=frame, title="Rotate PDF Options", geometry="300x180", focus=pages_entry,
+            on_ok=on_ok, reset=lambda: (pages_var.set("all"), angle_var.set(90))) # Default to all pages, 90 degrees
+
+        # Page Number Position
+        frame = ttk.Frame(dialog)
+        ttk.Label(frame, text="Select position:").pack(pady=5)
+        positions = ['bottom-center', 'bottom-left', 'bottom-right', 'top-center', 'top-left', 'top-right']
+        position_var = tk.StringVar()
+        position_combo = bootttk.Combobox(frame, textvariable=position_var, values=positions, state="readonly", width=18)
+        position_combo.pack(pady=5)
+        on_ok = lambda: close({"position": position_var.get()})
+        add_buttons(frame, on_ok, pady=15)
+        modal["frames"]["position"] = dict(frame=frame, title="Page Number Position", geometry="300x130", focus=position_combo,
+            on_ok=on_ok, reset=lambda: position_var.set(positions[0]))
+
+    def show_modal(name):
+        """Shows one frame of the shared dialog modally. Returns its result dict, or None if cancelled."""
+        dialog, spec = modal["window"], modal["frames"][name]
+        for other in modal["frames"].values(): other["frame"].pack_forget()
+        spec["reset"](); spec["frame"].pack(fill=tk.BOTH, expand=True)
+        dialog.title(spec["title"]); dialog.geometry(spec["geometry"])
+        modal.update(result=None, on_ok=spec["on_ok"]); modal["done"].set(False)
+        dialog.deiconify(); dialog.grab_set(); spec["focus"].focus_set()
+        root.wait_variable(modal["done"])
+        dialog.grab_release(); dialog.withdraw()
+        return modal["result"]
+
+    def ask_password():
+        result = show_modal("password")
+        return result["password"] if result else None # None if cancelled
 
     def ask_split_ranges():
         # Use simpledialog for this one as it's just a string
@@ -45,159 +290,156 @@ def client_program():
         return ranges
 
     def ask_rotate_options():
-        dialog = tk.Toplevel(root)
-        dialog.title("Rotate PDF Options")
-        dialog.geometry("300x180"); dialog.transient(root); dialog.grab_set(); dialog.resizable(False, False)
-        result = {"pages": None, "angle": None}
-        # Pages Entry
-        ttk.Label(dialog, text="Pages to rotate (e.g., 1, 3-5, all):").pack(pady=5, padx=10, anchor='w')
-        pages_var = tk.StringVar(value="all") # Default to all
-        pages_entry = ttk.Entry(dialog, textvariable=pages_var)
-        pages_entry.pack(pady=2, padx=10, fill=tk.X)
-        pages_entry.focus_set()
-        # Angle Selection
-        ttk.Label(dialog, text="Rotation angle:").pack(pady=5, padx=10, anchor='w')
-        angle_var = tk.IntVar(value=90)
-        angle_combo = bootttk.Combobox(dialog, textvariable=angle_var, values=[90, 180, 270, -90], state="readonly", width=10)
-        angle_combo.pack(pady=2, padx=10)
-        def on_ok(): result["pages"] = pages_var.get(); result["angle"] = angle_var.get(); dialog.destroy()
-        def on_cancel(): dialog.destroy()
-        button_frame = ttk.Frame(dialog); button_frame.pack(pady=15)
-        ttk.Button(button_frame, text="OK", command=on_ok, bootstyle="primary").pack(side=tk.LEFT, padx=10)
-        ttk.Button(button_frame, text="Cancel", command=on_cancel).pack(side=tk.RIGHT, padx=10)
-        dialog.bind('<Return>', lambda event=None: on_ok())
-        root.wait_window(dialog)
-        return result["pages"], result["angle"] # Returns None, None if cancelled
+        result = show_modal("rotate")
+        return (result["pages"], result["angle"]) if result else (None, None) # Returns None, None if cancelled
 
     def ask_page_number_position():
-         dialog = tk.Toplevel(root); dialog.title("Page Number Position"); dialog.geometry("300x130")
-         dialog.transient(root); dialog.grab_set(); dialog.resizable(False, False)
-         result = {"position": None}
-         ttk.Label(dialog, text="Select position:").pack(pady=5)
-         positions = ['bottom-center', 'bottom-left', 'bottom-right', 'top-center', 'top-left', 'top-right']
-         position_var = tk.StringVar(value=positions[0])
-         position_combo = bootttk.Combobox(dialog, textvariable=position_var, values=positions, state="readonly", width=18)
-         position_combo.pack(pady=5)
-         position_combo.focus_set()
-         def on_ok(): result["position"] = position_var.get(); dialog.destroy()
-         def on_cancel(): dialog.destroy()
-         button_frame = ttk.Frame(dialog); button_frame.pack(pady=15)
-         ttk.Button(button_frame, text="OK", command=on_ok, bootstyle="primary").pack(side=tk.LEFT, padx=10)
-         ttk.Button(button_frame, text="Cancel", command=on_cancel).pack(side=tk.RIGHT, padx=10)
-         dialog.bind('<Return>', lambda event=None: on_ok())
-         root.wait_window(dialog)
-         return result["position"] # None if cancelled
+        result = show_modal("position")
+        return result["position"] if result else None # None if cancelled
+
+    # --- Thread Hand-off (Tk may only be touched from the main thread) ---
+    ui_queue = queue.Queue() # Callables posted by worker threads, drained on the Tk thread
+
+    def run_on_ui(func, *args, **kwargs):
+        """Runs func on the Tk main thread and returns its result, blocking the calling worker thread."""
+        if threading.current_thread() is threading.main_thread(): return func(*args, **kwargs)
+        done = threading.Event(); outcome = {}
+        def call():
+            try: outcome["value"] = func(*args, **kwargs)
+            except Exception as e: outcome["error"] = e
+            finally: done.set()
+        ui_queue.put(call)
+        done.wait()
+        if "error" in outcome: raise outcome["error"]
+        return outcome.get("value")
+
+    def process_ui_queue():
+        """Periodically runs callables queued by worker threads."""
+        while True:
+            try: call = ui_queue.get_nowait()
+            except queue.Empty: break
+            try: call()
+            except Exception: log.exception("Error in queued UI callback")
+        root.after(50, process_ui_queue)
 
     # --- Main Communication Logic ---
-    def send_request_to_server(action, file_path_or_paths, options=None):
+    def send_request_to_server(action, file_path_or_paths, options=None, progress=None):
         is_merge = action == "merge"
-        local_zip_to_send = None
+        file_to_send = None # Open input file for the request body (merge streams its zip instead)
         sock = None
+        fresh_connection = False # Connected for this request (not from the pool)
+        reusable = False # Set once the response has been fully consumed
         options = options or {} # Ensure options is a dict
+        progress = progress or (lambda text: None) # Status text sink, called from this (worker) thread
 
         try:
-            # Establish Connection
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(30.0) # Shorter timeout for initial connect
-            print(f"Connecting to {HOST}:{PORT}...")
-            sock.connect((HOST, PORT))
-            print(f"Connected to server for action: {action}")
-            sock.settimeout(600.0) # Longer timeout for operations/transfer
-
-            # 1. Send Action
-            print(f"Sending action: {action}")
-            sock.sendall(action.encode())
-            ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-            if ack != b'ACK_ACTION': raise ConnectionAbortedError("Invalid ACK after sending action.")
+            # Establish Connection (reuse a pooled keep-alive connection when possible)
+            sock = _socket_pool_acquire((HOST, PORT))
+            if sock:
+                log.debug("Reusing pooled connection to %s:%s for action: %s", HOST, PORT, action)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                fresh_connection = True
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Don't let Nagle hold back the small handshake messages
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE) # Set before connect() so the TCP window can scale
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # Detect a dead server instead of blocking forever
+                for opt_name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 6)):
+                    if hasattr(socket, opt_name): sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt_name), value)
+                if sys.platform.startswith("linux"): # TCP Fast Open: connect() returns at once and the request header rides on the SYN
+                    try: sock.setsockopt(socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1) # Without a cached cookie this is a normal handshake
+                    except OSError: pass # Kernel older than 4.11
+                sock.settimeout(30.0) # Fail fast on connect; kept until the header is sent (with Fast Open the SYN leaves with it)
+                log.debug("Connecting to %s:%s...", HOST, PORT)
+                sock.connect((HOST, PORT))
+                log.info("Connected to server for action: %s", action)
 
             # --- Prepare File Info ---
             if is_merge:
                 if not isinstance(file_path_or_paths, (list, tuple)) or len(file_path_or_paths) < 2:
                     raise ValueError("Merge action requires at least two files.")
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as temp_zip:
-                    local_zip_to_send = temp_zip.name
-                    print(f"Creating temporary zip for merge: {local_zip_to_send}")
-                    valid_files_count = 0
-                    with zipfile.ZipFile(temp_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                        for file_path in file_path_or_paths:
-                             if os.path.isfile(file_path): zipf.write(file_path, os.path.basename(file_path)); valid_files_count+=1
-                             else: print(f"Warning: Skipping non-existent file for merge: {file_path}")
-                    if valid_files_count < 2 : raise ValueError(f"Merge requires at least two valid files (found {valid_files_count}).")
-                file_to_send = local_zip_to_send
+                merge_inputs = [] # (path, os.stat_result): one stat per input, reused for the zip entries
+                for file_path in file_path_or_paths:
+                     try: st = os.stat(file_path)
+                     except OSError: st = None
+                     if st and stat.S_ISREG(st.st_mode): merge_inputs.append((file_path, st))
+                     else: log.warning("Skipping non-existent file for merge: %s", file_path)
+                valid_files_count = len(merge_inputs)
+                if valid_files_count < 2 : raise ValueError(f"Merge requires at least two valid files (found {valid_files_count}).")
+                file_size = CHUNKED_SIZE # Zip is built while it is sent, length unknown up front
                 filename_for_server = f"merge_input_{valid_files_count}files.zip"
             else:
-                if not isinstance(file_path_or_paths, str) or not os.path.isfile(file_path_or_paths):
+                try: st = os.stat(file_path_or_paths) if isinstance(file_path_or_paths, str) else None
+                except OSError: st = None
+                if not st or not stat.S_ISREG(st.st_mode):
                      raise ValueError(f"Input file not found or invalid: {file_path_or_paths}")
-                file_to_send = file_path_or_paths
-                filename_for_server = os.path.basename(file_to_send)
+                file_size = st.st_size
+                file_to_send = open(file_path_or_paths, "rb")
+                filename_for_server = os.path.basename(file_path_or_paths)
             # --- End Prepare File Info ---
 
-            # 2. Send Base Filename
-            print(f"Sending base filename: {filename_for_server}")
-            sock.sendall(filename_for_server.encode())
-            ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-            if ack != b'ACK_FILENAME': raise ConnectionAbortedError("Invalid ACK after sending filename.")
-
-            # 3. Send File Size & Data
-            file_size = os.path.getsize(file_to_send)
-            print(f"Sending file size: {file_size}")
-            sock.sendall(str(file_size).encode().ljust(16))
-            ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-            if ack != b'ACK_SIZE': raise ConnectionAbortedError("Invalid ACK after sending size.")
-            print(f"Sending file data from: {file_to_send}...")
-            with open(file_to_send, "rb") as f:
-                 bytes_sent = 0
-                 while True:
-                     chunk = f.read(65536);
-                     if not chunk: break
-                     sock.sendall(chunk); bytes_sent += len(chunk)
-            print(f"Sent {bytes_sent} bytes of file data.")
-
-            # 4. Send Extra Options (if required by action)
+            # --- Check Extra Options (sent inside the header) ---
             if action in ("encrypt", "decrypt"):
-                password = options.get("password") # Get from options dict
-                if password is None: raise ValueError("Password not provided for encrypt/decrypt.")
-                print("Sending password...")
-                sock.sendall(password.encode()); ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-                if ack != b'ACK_PASS': raise ConnectionAbortedError("Invalid ACK after sending password.")
+                if options.get("password") is None: raise ValueError("Password not provided for encrypt/decrypt.")
             elif action == "split":
-                ranges_str = options.get("ranges")
-                if not ranges_str: raise ValueError("Split ranges not provided.")
-                print(f"Sending split ranges: {ranges_str}")
-                sock.sendall(ranges_str.encode()); ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-                if ack != b'ACK_RANGES': raise ConnectionAbortedError("Invalid ACK after sending ranges.")
+                if not options.get("ranges"): raise ValueError("Split ranges not provided.")
             elif action == "rotate":
-                pages_str = options.get("pages"); angle_str = str(options.get("angle"))
-                if not pages_str or not angle_str: raise ValueError("Rotation pages/angle not provided.")
-                print(f"Sending rotate pages: {pages_str}")
-                sock.sendall(pages_str.encode()); ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-                if ack != b'ACK_PAGES': raise ConnectionAbortedError("Invalid ACK after sending pages.")
-                print(f"Sending rotate angle: {angle_str}")
-                sock.sendall(angle_str.encode()); ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-                if ack != b'ACK_ANGLE': raise ConnectionAbortedError("Invalid ACK after sending angle.")
+                if not options.get("pages") or options.get("angle") is None: raise ValueError("Rotation pages/angle not provided.")
             elif action == "add_numbers":
-                position = options.get("position")
-                if not position: raise ValueError("Page number position not provided.")
-                print(f"Sending page number position: {position}")
-                sock.sendall(position.encode()); ack = sock.recv(1024); print(f"Recv ACK: {ack}")
-                if ack != b'ACK_POSITION': raise ConnectionAbortedError("Invalid ACK after sending position.")
+                if not options.get("position"): raise ValueError("Page number position not provided.")
+
+            # 1. Send Request Header (4-byte length prefix + JSON: action, filename, size, options)
+            header = json.dumps({"action": action, "filename": filename_for_server, "size": file_size, "options": options}).encode()
+            log.info("Sending request header for action '%s': %s (%s bytes)", action, filename_for_server, 'chunked' if file_size == CHUNKED_SIZE else file_size)
+            progress(f"Uploading: {filename_for_server}...")
+            sock.sendall(struct.pack("!I", len(header)) + header)
+            if fresh_connection: # With Fast Open, connect() and the header send return before the handshake completes
+                if not select.select([], [sock], [], 30.0)[1]: raise socket.timeout("Timed out connecting to the server.") # Writable once established
+                connect_error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if connect_error: raise OSError(connect_error, os.strerror(connect_error)) # e.g. ConnectionRefusedError
+            sock.settimeout(None) # Plain blocking I/O for the stream phase; TCP keepalive catches dead peers
+
+            # 2. Send File Data
+            log.debug("Sending file data...")
+            if is_merge:
+                 # Stream the zip straight onto the socket as chunks: no temp file, sending starts immediately
+                 log.debug("Streaming zip for merge...")
+                 # PDFs are already Flate-compressed internally; only deflate if non-PDF inputs are present
+                 zip_compression = zipfile.ZIP_DEFLATED if any(not p.lower().endswith('.pdf') for p, _ in merge_inputs) else zipfile.ZIP_STORED
+                 def read_merge_input(path, size):
+                     with open(path, "rb") as f: return f.read(size) # Size known from the stat above
+                 body = _ChunkedWriter(sock, TRANSFER_CHUNK_SIZE)
+                 # Read inputs in parallel (bounded read-ahead) while the zip writer consumes them in order
+                 with zipfile.ZipFile(body, 'w', zip_compression) as zipf, ThreadPoolExecutor(max_workers=MERGE_READ_WORKERS) as read_pool:
+                     pending_reads = collections.deque()
+                     def write_oldest():
+                         path, st, future = pending_reads.popleft()
+                         entry = zipfile.ZipInfo(os.path.basename(path), max(time.localtime(st.st_mtime)[:6], (1980, 1, 1, 0, 0, 0))) # Same timestamp zipf.write() would use
+                         entry.compress_type = zip_compression
+                         zipf.writestr(entry, future.result())
+                     for file_path, st in merge_inputs:
+                         pending_reads.append((file_path, st, read_pool.submit(read_merge_input, file_path, st.st_size)))
+                         if len(pending_reads) >= MERGE_READ_WORKERS: write_oldest()
+                     while pending_reads: write_oldest()
+                 body.close() # Sends the terminating zero-length chunk
+                 bytes_sent = body.bytes_sent
+            else:
+                 bytes_sent = sock.sendfile(file_to_send) # os.sendfile() where available, falls back to a send() loop otherwise
+            log.info("Sent %s bytes of file data.", bytes_sent)
 
             # --- Receive Result ---
-            print("Waiting for result from server...")
-
-            # 5. Receive Output Filename Suggestion
-            output_filename_suggestion_bytes = sock.recv(1024)
-            if not output_filename_suggestion_bytes: raise ConnectionAbortedError("Server disconnected before sending output filename.")
-            output_filename_suggestion = output_filename_suggestion_bytes.decode()
-            sock.sendall(b"ACK_OUT_FILENAME"); print("Sent ACK_OUT_FILENAME")
-            print(f"Received suggested output filename: {output_filename_suggestion}")
-
-            # 6. Receive Output File Size
-            output_size_bytes = sock.recv(16)
-            if not output_size_bytes: raise ConnectionAbortedError("Server disconnected before sending output size.")
-            output_size = int(output_size_bytes.decode().strip())
-            sock.sendall(b"ACK_OUT_SIZE"); print("Sent ACK_OUT_SIZE")
-            print(f"Expecting output size: {output_size} bytes")
+            log.debug("Waiting for result from server...")
+            progress(f"Processing on server: {filename_for_server}...")
+
+            # 3. Receive Output Filename Suggestion
+            name_len = struct.unpack("!H", _recv_exact(sock, 2))[0] # 2-byte big-endian length, name and size follow without an ACK
+            output_filename_suggestion = _recv_exact(sock, name_len).decode()
+            log.debug("Received suggested output filename: %s", output_filename_suggestion)
+
+            # 4. Receive Output File Size
+            output_size = struct.unpack("!Q", _recv_exact(sock, 8))[0] # 8-byte big-endian size, data follows without an ACK
+            chunked_result = output_size == CHUNKED_RESULT_SIZE # Zip streamed while the server builds it, length unknown
+            log.debug("Expecting output size: %s", "chunked" if chunked_result else f"{output_size} bytes")
 
             # Check for server error signal (0 size + error name)
             if output_size == 0 and "error_" in output_filename_suggestion.lower():
@@ -206,21 +448,12 @@ def client_program():
                 raise Exception(f"Server Error: {error_msg}" if error_msg else f"Server indicated an error ({output_filename_suggestion}).")
             elif output_size == 0:
                 # Valid empty file (e.g., split resulted in nothing for ranges)
-                 messagebox.showwarning("Empty Result", f"Server returned an empty result file for action '{action}'.\nFilename: {output_filename_suggestion}", parent=root)
+                 run_on_ui(messagebox.showwarning, "Empty Result", f"Server returned an empty result file for action '{action}'.\nFilename: {output_filename_suggestion}", parent=root)
                  # No need to receive data or save. Indicate completion.
+                 reusable = True
                  return True # Indicate success but with empty result
 
-            # 7. Receive Output File Data
-            print(f"Receiving result data ({output_size} bytes)...")
-            output_data = b""
-            received_bytes = 0
-            while received_bytes < output_size:
-                chunk = sock.recv(min(65536, output_size - received_bytes))
-                if not chunk: raise ConnectionAbortedError(f"Server disconnected during result transfer ({received_bytes}/{output_size} received).")
-                output_data += chunk; received_bytes += len(chunk)
-            print(f"Received {len(output_data)} bytes of result data.")
-
-            # --- Save Result ---
+            # --- Choose Save Location (before receiving, so data can stream straight to disk) ---
             default_ext = os.path.splitext(output_filename_suggestion)[1] or ".bin" # Ensure default ext
             file_types = []
             type_map = {".pdf": "PDF files", ".zip": "ZIP archives", ".docx": "Word Documents", ".pptx": "PowerPoint Presentations"}
@@ -228,42 +461,70 @@ def client_program():
             if desc: file_types.append((desc, f"*{default_ext.lower()}"))
             file_types.append(("All files", "*.*"))
 
-            save_path = filedialog.asksaveasfilename(parent=root, title=f"Save Result ({action})",
+            save_path = run_on_ui(filedialog.asksaveasfilename, parent=root, title=f"Save Result ({action})",
                 initialfile=output_filename_suggestion, defaultextension=default_ext, filetypes=file_types)
 
-            if save_path:
-                with open(save_path, "wb") as f: f.write(output_data)
-                messagebox.showinfo("Success", f"File processed and saved successfully!\nPath: {save_path}", parent=root)
-                return True # Indicate success
-            else:
-                messagebox.showwarning("Cancelled", "Save operation cancelled by user.", parent=root)
-                return False # Indicate cancellation
+            if not save_path:
+                run_on_ui(messagebox.showwarning, "Cancelled", "Save operation cancelled by user.", parent=root)
+                return False # Indicate cancellation (connection is closed, server stops sending)
+
+            # 5. Receive Output File Data
+            log.debug("Receiving result data (%s) into: %s...", "chunked" if chunked_result else f"{output_size} bytes", save_path)
+            try:
+                if chunked_result:
+                    with open(save_path, "wb") as dst:
+                        received_bytes = _copy_exact(_ChunkedReader(sock), dst, None, TRANSFER_CHUNK_SIZE,
+                            progress=lambda done: progress(f"Receiving: {output_filename_suggestion} ({done // (1024 * 1024)} MB)"))
+                else:
+                    with sock.makefile("rb", buffering=0) as src, open(save_path, "wb") as dst:
+                        received_bytes = _copy_exact(src, dst, output_size, TRANSFER_CHUNK_SIZE,
+                            progress=lambda done: progress(f"Receiving: {output_filename_suggestion} ({done * 100 // output_size}%)"))
+            except Exception:
+                # Don't leave a truncated result behind
+                try: os.remove(save_path)
+                except OSError: pass
+                raise
+            log.info("Received %s bytes of result data.", received_bytes)
+            reusable = True
 
-        except socket.timeout: messagebox.showerror("Timeout Error", "Connection or operation timed out.", parent=root); return False
-        except ConnectionRefusedError: messagebox.showerror("Connection Error", "Could not connect to the server.", parent=root); return False
-        except (ConnectionAbortedError, ConnectionResetError) as cae: messagebox.showerror("Connection Error", f"Connection lost:\n{cae}", parent=root); return False
-        except ValueError as ve: messagebox.showerror("Input Error", f"{ve}", parent=root); return False
+            run_on_ui(messagebox.showinfo, "Success", f"File processed and saved successfully!\nPath: {save_path}", parent=root)
+            return True # Indicate success
+
+        except socket.timeout: run_on_ui(messagebox.showerror, "Timeout Error", "Connection or operation timed out.", parent=root); return False
+        except ConnectionRefusedError: run_on_ui(messagebox.showerror, "Connection Error", "Could not connect to the server.", parent=root); return False
+        except (ConnectionAbortedError, ConnectionResetError) as cae: run_on_ui(messagebox.showerror, "Connection Error", f"Connection lost:\n{cae}", parent=root); return False
+        except ValueError as ve: run_on_ui(messagebox.showerror, "Input Error", f"{ve}", parent=root); return False
         except Exception as e:
-            print(f"An unexpected client error occurred:\n{traceback.format_exc()}")
-            messagebox.showerror("Error", f"An unexpected error occurred:\n{e}", parent=root); return False
+            log.exception("An unexpected client error occurred")
+            run_on_ui(messagebox.showerror, "Error", f"An unexpected error occurred:\n{e}", parent=root); return False
         finally:
-            if local_zip_to_send and os.path.exists(local_zip_to_send):
-                 try: os.remove(local_zip_to_send); print(f"Removed temporary zip: {local_zip_to_send}")
-                 except OSError as e_rem: print(f"Warning: Could not remove temp zip {local_zip_to_send}: {e_rem}")
-            if sock:
+            if file_to_send: file_to_send.close()
+            if sock and reusable and _socket_pool_release((HOST, PORT), sock):
+                log.debug("Connection returned to pool.")
+            elif sock:
                 try: sock.shutdown(socket.SHUT_RDWR)
                 except OSError: pass
-                finally: sock.close(); print("Socket closed.")
+                finally: sock.close(); log.debug("Socket closed.")
         return False # Indicate failure if exception occurred
 
     # --- UI Button Callbacks ---
+    pending_status = {} # label -> latest status text, applied by flush_label_status()
+
     def update_label_status(label, text):
-         """Helper to update label and force UI refresh."""
-         if isinstance(label, ttk.Label): # Check if it's a valid label widget
-            label.config(text=text)
-            root.update_idletasks()
-         else:
-             print(f"Warning: Attempted to update non-label widget: {label}")
+         """Records a label update; flush_label_status() applies it (safe from worker threads and transfer loops)."""
+         pending_status[label] = text
+
+    def flush_label_status():
+         """Applies pending label updates with one UI refresh, at most 10 times per second."""
+         if pending_status:
+             while pending_status:
+                 label, text = pending_status.popitem()
+                 if isinstance(label, ttk.Label): # Check if it's a valid label widget
+                    label.config(text=text)
+                 else:
+                     log.warning("Attempted to update non-label widget: %s", label)
+             root.update_idletasks()
+         root.after(100, flush_label_status)
 
     # Generic file upload handler, now focuses on getting path and calling server comms
     def handle_upload(file_types, label, action, options_func=None, is_multiple=False, title_suffix=""):
@@ -292,21 +553,27 @@ def client_program():
             display_name = f"{len(file_path_or_paths)} files" if is_multiple else os.path.basename(file_path_or_paths)
             update_label_status(label, f"Processing: {display_name}...")
 
-            # Call the server communication function
-            success = send_request_to_server(action, file_path_or_paths, options=opts)
-
-            # Update label based on success/failure/cancel
-            if success is True:
-                update_label_status(label, f"Completed: {display_name}")
-            elif success is False and not is_multiple: # Check if save was cancelled (False returned)
-                 update_label_status(label, f"Selected: {display_name} (Save Cancelled)")
-            elif success is False and is_multiple:
-                 update_label_status(label, f"Selected: {display_name} (Merge Cancelled/Failed)")
-            else: # Handle unexpected errors from send_request
-                update_label_status(label, f"Failed: {display_name}")
+            # Update label based on success/failure/cancel (runs on the Tk thread)
+            def finish(success):
+                if success is True:
+                    update_label_status(label, f"Completed: {display_name}")
+                elif success is False and not is_multiple: # Check if save was cancelled (False returned)
+                     update_label_status(label, f"Selected: {display_name} (Save Cancelled)")
+                elif success is False and is_multiple:
+                     update_label_status(label, f"Selected: {display_name} (Merge Cancelled/Failed)")
+                else: # Handle unexpected errors from send_request
+                    update_label_status(label, f"Failed: {display_name}")
+
+            # Call the server communication function in a background thread so the UI stays responsive
+            def worker():
+                success = None
+                try: success = send_request_to_server(action, file_path_or_paths, options=opts, progress=lambda text: update_label_status(label, text))
+                except Exception: log.exception("Error in request worker for %s", action)
+                finally: ui_queue.put(lambda: finish(success))
+            threading.Thread(target=worker, name=f"request-{action}", daemon=True).start()
 
         except Exception as e:
-             print(f"Error during handle_upload for {action}: {traceback.format_exc()}")
+             log.exception("Error during handle_upload for %s", action)
              messagebox.showerror("Client Error", f"Failed during UI operation:\n{e}", parent=root)
              label.config(text=original_text) # Restore label on error
 
@@ -322,6 +589,7 @@ def client_program():
     root = ttk.Window(title="Advanced File Converter & PDF Tools v1.1", themename="darkly")
     root.geometry("750x750")
     root.columnconfigure(0, weight=1); root.rowconfigure(0, weight=1)
+    build_modal_dialog() # Option dialogs are built once and reused
 
     base_frame = ttk.Frame(root); base_frame.grid(row=0, column=0, sticky="nsew")
     base_frame.rowconfigure(0, weight=1); base_frame.columnconfigure(0, weight=1)
@@ -377,7 +645,10 @@ def client_program():
     add_option_row(main_frame, "Rotate PDF", lambda l: handle_upload(pdf_types, l, "rotate", options_func=get_rotate_opts, title_suffix="Rotate PDF"), initial_label_text="No PDF selected for Rotate PDF")
     add_option_row(main_frame, "Add Page Numbers", lambda l: handle_upload(pdf_types, l, "add_numbers", options_func=get_add_numbers_opts, title_suffix="Add Page Numbers"), initial_label_text="No PDF selected for Add Page Numbers")
 
+    root.after(50, process_ui_queue) # Start draining worker -> UI callbacks
+    root.after(100, flush_label_status) # Start applying batched label updates
     root.mainloop()
+    _socket_pool_close_all()
 
 if __name__ == '__main__':
     client_program()
\ No newline at end of file
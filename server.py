@@ -4,6 +4,19 @@ import tempfile
 import shutil
 import zipfile
 import io
+import json
+import struct
+import threading
+import itertools
+import atexit
+import multiprocessing
+import contextlib
+import selectors
+import mmap
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import comtypes.client # type: ignore
 import pypdf # Use pypdf for newer features / potentially better handling
 import traceback # For detailed error logging
@@ -17,27 +30,258 @@ import fitz # PyMuPDF
 # --- Other libraries for specific conversions/actions ---
 from pdf2docx import Converter as PDF2WordConverter # For PDF to Word
 from pptx import Presentation # For PDF to PPTX
-from pptx.util import Inches, Emu # For PDF to PPTX (Emu for direct use)
+from pptx.util import Inches # For PDF to PPTX
 from reportlab.pdfgen import canvas # For Page Numbers
 from reportlab.lib.units import inch # For Page Numbers
 # from reportlab.lib.pagesizes import letter # Use actual page size instead
 # --- End Imports ---
 
 
-# --- Office Conversion Functions (Require MS Office Installed) ---
-# Ensure COM is initialized/uninitialized per function call for thread safety
-def convert_docx_to_pdf(input_path, output_path):
-    word = None
-    doc = None
-    com_initialized = False
+# --- Protocol Helpers ---
+MAX_HEADER_SIZE = 64 * 1024 # Upper bound for the JSON request header
+CHUNKED_SIZE = -1 # Header "size" for a chunked body: [!I length][data] chunks, ended by a zero length
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024 # SO_RCVBUF/SO_SNDBUF for client connections (matches the client side)
+CONTROL_BUFFER_SIZE = 64 * 1024 # Read buffer for headers and chunk lengths
+SEND_CHUNK_SIZE = 1024 * 1024 # Result send chunk where sendfile() is unavailable
+RECV_BUFFER_SIZE = 4 * 1024 * 1024 # Per-request receive buffer for upload bodies: one disk write per 4 MiB
+CHUNKED_RESULT_SIZE = 0xFFFFFFFFFFFFFFFF # Result "size" (!Q) for chunked result data: [!I length][data] chunks, ended by a zero length
+
+def name_frame(name):
+    """Frames a result filename as [!H length][UTF-8 name], so the client reads it exactly without an ACK."""
+    name_bytes = name.encode()
+    return struct.pack("!H", len(name_bytes)) + name_bytes
+
+def control_frame(action):
+    """Encodes a body-less request ([!I length][JSON header]) exactly as the client sends it for a connection-level action."""
+    header = json.dumps({"action": action}).encode()
+    return struct.pack("!I", len(header)) + header
+
+# Constant frames, encoded once instead of on every request
+PING_REQUEST = control_frame("ping") # Answered on the event loop when it arrives whole (see answer_ping())
+PONG = b"PONG"
+END_CHUNK = struct.pack("!I", 0) # Zero-length chunk: end of chunked data
+EMPTY_SIZE = struct.pack("!Q", 0) # Size 0: error reply, the message follows
+CHUNKED_RESULT_MARK = struct.pack("!Q", CHUNKED_RESULT_SIZE)
+ERROR_FILE_NOT_FOUND_NAME = name_frame("error_file_not_found.bin")
+ERROR_PROCESSING_NAME = name_frame("error_processing.bin")
+ERROR_BAD_REQUEST_NAME = name_frame("error_bad_request.bin")
+
+def recv_exact(rfile, n):
+    """Reads exactly n bytes from the connection's buffered reader (conn.makefile("rb")) or raises ConnectionAbortedError."""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = rfile.readinto(view[received:])
+        if not count: raise ConnectionAbortedError(f"Client disconnected mid-message ({received}/{n} bytes received).")
+        received += count
+    return bytes(buf)
+
+@contextlib.contextmanager
+def corked(conn):
+    """Holds back partial TCP segments while the block runs (Linux TCP_CORK), so small writes leave merged
+    with the data that follows. No-op where TCP_CORK does not exist; callers then merge writes themselves."""
+    if not hasattr(socket, "TCP_CORK"):
+        yield
+        return
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
     try:
+        yield
+    finally:
+        try: conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0) # Uncork: flush whatever is still pending
+        except OSError: pass # Connection already broken
+
+def sendall_buffers(sock, buffers):
+    """Sends buffers back to back, like sendall(b"".join(buffers)) but without the join where sendmsg() exists:
+    the kernel gathers them (writev-style), so a small header and a large chunk need neither a copy nor two sends."""
+    if not hasattr(sock, "sendmsg"): # Windows
+        sock.sendall(b"".join(buffers))
+        return
+    views = [memoryview(b).cast("B") for b in buffers if len(b)]
+    while views:
+        sent = sock.sendmsg(views) # May be partial, like send()
+        while sent:
+            if sent >= len(views[0]): sent -= len(views[0]); views.pop(0)
+            else: views[0] = views[0][sent:]; sent = 0
+
+def send_file_mapped(conn, f, head, size, chunk_size=SEND_CHUNK_SIZE):
+    """Sends head followed by the first size bytes of the open file f, for platforms without os.sendfile().
+    The file is memory-mapped and sent as memoryview slices of the mapping: no read() copies or per-chunk
+    buffers, the OS pages the file in as the socket consumes it. head rides along with the first chunk.
+    Returns the number of file bytes sent."""
+    if not size: # mmap cannot map an empty file
+        conn.sendall(head)
+        return 0
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        first = min(chunk_size, size)
+        sendall_buffers(conn, [head, view[:first]]) # Gathered with the first chunk
+        for offset in range(first, size, chunk_size): conn.sendall(view[offset:offset + chunk_size]) # Bounded sendall(): the socket timeout applies per chunk
+    return size
+
+class _ChunkedWriter:
+    """Write-only file object that sends data as [!I length][data] chunks on a socket (result size CHUNKED_RESULT_SIZE).
+    Small writes are gathered into chunk_size chunks; close() sends the zero-length chunk that ends the data.
+    head (e.g. the result size) rides along with the first chunk."""
+    def __init__(self, conn, chunk_size=SEND_CHUNK_SIZE, head=b""):
+        self._conn = conn
+        self._head = head
+        self._chunk_size = chunk_size
+        self._pending = bytearray()
+        self.bytes_sent = 0
+
+    def write(self, data):
+        self._pending += data
+        if len(self._pending) >= self._chunk_size: self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._pending: return
+        sendall_buffers(self._conn, [self._head, struct.pack("!I", len(self._pending)), self._pending]) # Chunk data is not copied again
+        self._head = b""
+        self.bytes_sent += len(self._pending)
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._conn.sendall(self._head + END_CHUNK)
+
+_recv_buffers = threading.local() # Per worker thread: one upload receive buffer, reused by every request it serves
+
+def recv_buffer():
+    """Returns this thread's RECV_BUFFER_SIZE memoryview for recv_body_to_file(), allocating it on first use."""
+    buf = getattr(_recv_buffers, "view", None)
+    if buf is None: buf = _recv_buffers.view = memoryview(bytearray(RECV_BUFFER_SIZE))
+    return buf
+
+def recv_body_to_file(rfile, f, size, buf):
+    """Receives a request body (size bytes, or chunked when size == CHUNKED_SIZE) and writes it to the open file f.
+    buf is a reused memoryview that is filled across recv_into() calls and chunk boundaries and written only
+    when full or at the end of the body, so a large upload costs one write() per len(buf) bytes.
+    f should be unbuffered (open(..., buffering=0)) so each flush is a single os.write() of the view."""
+    filled = 0 # Bytes waiting in buf
+    total = 0
+    def flush():
+        nonlocal filled
+        written = 0
+        while written < filled: written += f.write(buf[written:filled]) # Raw writes may be partial
+        filled = 0
+    def fill(n):
+        nonlocal filled, total
+        while n:
+            count = rfile.readinto(buf[filled:filled + min(n, len(buf) - filled)])
+            if not count: raise ConnectionAbortedError(f"Client disconnected during file transfer ({total} bytes received).")
+            filled += count; total += count; n -= count
+            if filled == len(buf): flush()
+    if size == CHUNKED_SIZE: # Streamed body of unknown length (e.g. merge zip built on the fly)
+        while True:
+            chunk_len = struct.unpack("!I", recv_exact(rfile, 4))[0]
+            if not chunk_len: break # Zero-length chunk ends the body
+            fill(chunk_len)
+    else:
+        fill(size)
+    flush()
+    return total
+
+
+# --- Filename Helpers ---
+class _SafeNameTable(dict):
+    """str.translate() table: keeps alphanumerics (Unicode-aware, like str.isalnum) and the extra characters, maps the rest to '_'.
+    ASCII is filled in up front, so typical names are translated entirely in C. Other code points are decided on each lookup
+    and never stored: clients choose the names, so a memo of them would grow for the life of the server."""
+    def __init__(self, keep=""):
+        self.keep = keep
+        super().__init__((code_point, self._map(code_point)) for code_point in range(128))
+    def _map(self, code_point):
+        char = chr(code_point)
+        return code_point if char.isalnum() or char in self.keep else ord("_")
+    __missing__ = _map
+
+_SAFE_NAME = _SafeNameTable("_-") # Upload base names
+_SAFE_NAME_ALNUM = _SafeNameTable() # Split part names
+
+def safe_name(name, table=_SAFE_NAME):
+    return name.translate(table)
+
+
+# --- Office Conversion Functions (Require MS Office Installed) ---
+# Office apps are started once per thread and reused; COM objects must stay on the thread (apartment) that created them
+_office_apps = threading.local()
+
+def _get_office_app(prog_id):
+    """Returns this thread's cached Office application for prog_id, starting it (and COM) on first use."""
+    if not hasattr(_office_apps, "apps"):
         try:
             comtypes.CoInitialize()
-            com_initialized = True
+            _office_apps.com_initialized = True
         except OSError: # Already initialized on this thread
-            com_initialized = False
-        word = comtypes.client.CreateObject('Word.Application')
-        word.Visible = False
+            _office_apps.com_initialized = False
+        _office_apps.apps = {}
+    app = _office_apps.apps.get(prog_id)
+    if app is not None:
+        try: app.Name # Cheap liveness probe: the user may have closed the app
+        except Exception: del _office_apps.apps[prog_id]; app = None
+    if app is None:
+        print(f"Starting {prog_id} for thread {threading.current_thread().name}")
+        app = comtypes.client.CreateObject(prog_id)
+        if prog_id != "Powerpoint.Application": app.Visible = False # PowerPoint refuses to hide its window
+        _office_apps.apps[prog_id] = app
+    return app
+
+def release_office_apps():
+    """Quits the Office applications cached on the calling thread and uninitializes COM there."""
+    apps = getattr(_office_apps, "apps", None)
+    if apps is None: return
+    for prog_id, app in apps.items():
+        try: app.Quit()
+        except Exception as e: print(f"Error quitting {prog_id}: {e}")
+    apps.clear(); del _office_apps.apps
+    if _office_apps.com_initialized: comtypes.CoUninitialize()
+
+atexit.register(release_office_apps) # Apps started on the main thread
+
+# Worker processes (Office, render and PDF action pools) are spawned, never forked: a forked worker would inherit the
+# open client sockets and keep those connections alive after the server closes them. Windows only has spawn anyway.
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+MAX_POOL_WORKERS = 61 # ProcessPoolExecutor refuses more workers than this on Windows (ValueError)
+# The render and PDF action pools share one budget of a process per core instead of each claiming every core
+CPU_BUDGET = os.cpu_count() or 1
+RENDER_WORKERS = max(1, min(CPU_BUDGET // 2, MAX_POOL_WORKERS))
+ACTION_WORKERS = max(1, min(CPU_BUDGET - RENDER_WORKERS, MAX_POOL_WORKERS))
+COMPRESS_WORKERS = max(1, min(4, CPU_BUDGET // ACTION_WORKERS)) # Deflate threads per compress_pdf() call: one action worker's share of the cores
+
+# Office conversions run in worker processes: each owns its own COM apartment and Office instances, so clients convert in parallel
+OFFICE_WORKERS = 2
+OFFICE_PROG_IDS = ('Word.Application', 'Excel.Application', 'Powerpoint.Application')
+_office_pool = None
+_office_pool_lock = threading.Lock()
+
+def _init_office_worker():
+    """Worker process initializer: pre-starts the Office apps so the first request does not pay the launch."""
+    for prog_id in OFFICE_PROG_IDS:
+        try: _get_office_app(prog_id)
+        except Exception as e: print(f"Office worker {os.getpid()}: could not start {prog_id}: {e}")
+
+def start_office_pool():
+    global _office_pool
+    _office_pool = ProcessPoolExecutor(max_workers=OFFICE_WORKERS, mp_context=WORKER_CONTEXT, initializer=_init_office_worker)
+    print(f"Office worker pool started ({OFFICE_WORKERS} processes)")
+
+def run_office_conversion(func, input_path, output_path):
+    """Runs an Office converter in the worker pool and waits for it. Restarts the pool once if a worker died."""
+    pool = _office_pool
+    try:
+        return pool.submit(func, input_path, output_path).result()
+    except BrokenProcessPool:
+        with _office_pool_lock:
+            if _office_pool is pool: # Only the first thread to notice restarts it
+                print("Office worker pool broken (worker crashed), restarting it...")
+                start_office_pool()
+        return _office_pool.submit(func, input_path, output_path).result()
+
+def convert_docx_to_pdf(input_path, output_path):
+    doc = None
+    try:
+        word = _get_office_app('Word.Application')
         doc = word.Documents.Open(input_path)
         doc.SaveAs(output_path, FileFormat=17) # 17 = wdFormatPDF
         print(f"Successfully converted DOCX: {input_path} to {output_path}")
@@ -46,21 +290,12 @@ def convert_docx_to_pdf(input_path, output_path):
         raise # Re-raise the exception
     finally:
         if doc: doc.Close(False)
-        if word: word.Quit()
-        word, doc = None, None # Release objects
-        if com_initialized: comtypes.CoUninitialize()
+        doc = None # Release object
 
 def convert_pptx_to_pdf(input_path, output_path):
-    powerpoint = None
     presentation = None
-    com_initialized = False
     try:
-        try:
-            comtypes.CoInitialize()
-            com_initialized = True
-        except OSError:
-            com_initialized = False
-        powerpoint = comtypes.client.CreateObject("Powerpoint.Application")
+        powerpoint = _get_office_app("Powerpoint.Application")
         presentation = powerpoint.Presentations.Open(input_path, WithWindow=False)
         presentation.SaveAs(output_path, 32) # 32 = ppSaveAsPDF
         print(f"Successfully converted PPTX: {input_path} to {output_path}")
@@ -69,22 +304,12 @@ def convert_pptx_to_pdf(input_path, output_path):
         raise
     finally:
         if presentation: presentation.Close()
-        if powerpoint: powerpoint.Quit()
-        powerpoint, presentation = None, None
-        if com_initialized: comtypes.CoUninitialize()
+        presentation = None
 
 def convert_xlsx_to_pdf(input_path, output_path):
-    excel = None
     wb = None
-    com_initialized = False
     try:
-        try:
-            comtypes.CoInitialize()
-            com_initialized = True
-        except OSError:
-            com_initialized = False
-        excel = comtypes.client.CreateObject("Excel.Application")
-        excel.Visible = False
+        excel = _get_office_app("Excel.Application")
         wb = excel.Workbooks.Open(input_path)
         wb.ExportAsFixedFormat(0, output_path) # 0 = xlTypePDF
         print(f"Successfully converted XLSX: {input_path} to {output_path}")
@@ -93,22 +318,12 @@ def convert_xlsx_to_pdf(input_path, output_path):
         raise
     finally:
         if wb: wb.Close(False)
-        if excel: excel.Quit()
-        excel, wb = None, None
-        if com_initialized: comtypes.CoUninitialize()
+        wb = None
 
 def convert_html_to_pdf(input_path, output_path):
-    word = None
     doc = None
-    com_initialized = False
     try:
-        try:
-            comtypes.CoInitialize()
-            com_initialized = True
-        except OSError:
-            com_initialized = False
-        word = comtypes.client.CreateObject('Word.Application')
-        word.Visible = False
+        word = _get_office_app('Word.Application')
         doc = word.Documents.Open(input_path, Format="wdOpenFormatWebPages")
         doc.SaveAs(output_path, FileFormat=17) # wdFormatPDF
         print(f"Successfully converted HTML: {input_path} to {output_path}")
@@ -117,9 +332,7 @@ def convert_html_to_pdf(input_path, output_path):
         raise
     finally:
         if doc: doc.Close(False)
-        if word: word.Quit()
-        word, doc = None, None
-        if com_initialized: comtypes.CoUninitialize()
+        doc = None
 
 # --- General File Type Handler ---
 def handle_file_conversion(ext, input_path, output_path):
@@ -136,13 +349,13 @@ def handle_file_conversion(ext, input_path, output_path):
                 img_to_save.save(abs_output_path, "PDF", resolution=100.0, save_all=False) # Basic save
             print(f"Successfully converted Image: {abs_input_path} to {abs_output_path}")
         elif ext == ".docx":
-            convert_docx_to_pdf(abs_input_path, abs_output_path)
+            run_office_conversion(convert_docx_to_pdf, abs_input_path, abs_output_path)
         elif ext == ".pptx":
-            convert_pptx_to_pdf(abs_input_path, abs_output_path)
+            run_office_conversion(convert_pptx_to_pdf, abs_input_path, abs_output_path)
         elif ext == ".xlsx":
-            convert_xlsx_to_pdf(abs_input_path, abs_output_path)
+            run_office_conversion(convert_xlsx_to_pdf, abs_input_path, abs_output_path)
         elif ext == ".html":
-            convert_html_to_pdf(abs_input_path, abs_output_path)
+            run_office_conversion(convert_html_to_pdf, abs_input_path, abs_output_path)
         else:
             raise ValueError(f"Unsupported file format for 'convert' action: {ext}")
     except Exception as e:
@@ -190,9 +403,11 @@ def decrypt_pdf(input_path, output_path, password):
                  print(f"Decryption status: {decrypt_result}") # Log other statuses
         else:
             print("PDF was not encrypted, copying file as is.")
+            shutil.copyfile(input_path, output_path) # Nothing to remove: skip the object clone and re-serialization
+            return True
 
         writer = pypdf.PdfWriter()
-        writer.clone_document_from_reader(reader) # Clone regardless of encryption status
+        writer.clone_document_from_reader(reader)
 
         with open(output_path, 'wb') as output_file:
             writer.write(output_file)
@@ -206,33 +421,67 @@ def decrypt_pdf(input_path, output_path, password):
         raise ValueError(f"PDF Decryption failed: {e}") # Raise specific error
 
 # --- PDF to Other Format Functions ---
-def convert_pdf_to_jpg(input_path, output_dir):
-    """Converts PDF pages to JPG images using PyMuPDF."""
-    created_files = []
-    doc = None
+# Page rendering is spread over worker processes: PyMuPDF documents are not thread-safe and rendering holds the GIL
+RENDER_MIN_PAGES_PER_WORKER = 4 # Below this a worker costs more to dispatch than it saves
+RENDER_JPEG_QUALITY = 85
+EMU_PER_PIXEL = 914400 // 96 # 9525 EMU per pixel at 96 DPI (exact)
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def _get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None: # Created on first use: most servers never render
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=WORKER_CONTEXT)
+            print(f"Render worker pool started ({RENDER_WORKERS} processes)")
+        return _render_pool
+
+def open_pdf(input_path):
+    """Opens a PDF with PyMuPDF. filetype="pdf" skips content sniffing (inputs carry arbitrary temp names)."""
+    return fitz.open(input_path, filetype="pdf")
+
+def _pdf_page_count(input_path):
+    """Render worker entry point: the page count, so the request thread never opens the document itself."""
+    with open_pdf(input_path) as doc: return doc.page_count
+
+def _render_page_range(input_path, start, stop, dpi, fmt):
+    """Render worker entry point: renders pages [start, stop) of input_path to encoded fmt image bytes.
+    fitz documents cannot cross processes, so each worker opens its own.
+    Returns (image_bytes, width_px, height_px) per page, so callers never need to decode the image again for its size."""
+    rendered = []
+    with open_pdf(input_path) as doc:
+        for i in range(start, stop):
+            pix = doc[i].get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csRGB) # No alpha plane: both outputs are opaque
+            rendered.append((pix.tobytes(fmt, jpg_quality=RENDER_JPEG_QUALITY), pix.width, pix.height)) # jpg_quality is ignored for PNG
+    return rendered
+
+def render_pdf_pages(input_path, dpi, fmt):
+    """Renders every page of input_path to encoded image bytes (see _render_page_range).
+    The request thread only dispatches: the page count and every page range, even a single one, are handled in the
+    render pool, so concurrent requests never run fitz side by side in this process.
+    Large documents are split in page ranges across the pool. Returns (image_bytes, width_px, height_px) in page order."""
+    pool = _get_render_pool()
+    page_count = pool.submit(_pdf_page_count, input_path).result()
+    if not page_count: raise ValueError("Input PDF has no pages.")
+    workers = max(1, min(RENDER_WORKERS, page_count // RENDER_MIN_PAGES_PER_WORKER))
+    step = -(-page_count // workers) # Ceiling division: contiguous ranges, one per worker
+    futures = [pool.submit(_render_page_range, input_path, start, min(start + step, page_count), dpi, fmt)
+               for start in range(0, page_count, step)]
+    return [page for future in futures for page in future.result()]
+
+def convert_pdf_to_jpg(input_path):
+    """Converts PDF pages to JPG images using PyMuPDF.
+    Returns [(filename, jpeg_bytes)] in page order; nothing is written to disk."""
     try:
-        os.makedirs(output_dir, exist_ok=True)
-        print(f"Converting PDF to JPG using PyMuPDF: {input_path} -> {output_dir}")
-        doc = fitz.open(input_path)
-        if not doc.page_count: raise ValueError("Input PDF has no pages.")
+        print(f"Converting PDF to JPG using PyMuPDF: {input_path}")
         dpi = 150
-        for i, page in enumerate(doc):
-            pix = page.get_pixmap(dpi=dpi)
-            output_jpg_path = os.path.join(output_dir, f"page_{i+1:03d}.jpg")
-            pix.save(output_jpg_path, "jpeg")
-            created_files.append(output_jpg_path)
-        doc.close()
-        doc = None
-        if not created_files: raise Exception("PyMuPDF failed to convert any pages.")
-        print(f"Converted {len(created_files)} pages to JPG in {output_dir}")
-        return created_files
+        images = [(f"page_{i+1:03d}.jpg", data) for i, (data, _, _) in enumerate(render_pdf_pages(input_path, dpi, "jpeg"))]
+        if not images: raise Exception("PyMuPDF failed to convert any pages.")
+        print(f"Converted {len(images)} pages to JPG")
+        return images
     except Exception as e:
         print(f"Error converting PDF to JPG with PyMuPDF: {e}\n{traceback.format_exc()}")
-        if doc: doc.close() # Ensure closure on error
-        if os.path.exists(output_dir): shutil.rmtree(output_dir, ignore_errors=True)
         raise # Re-raise
-    finally:
-         if doc: doc.close()
 
 def convert_pdf_to_word(input_path, output_path):
     """Converts PDF to DOCX using pdf2docx."""
@@ -246,52 +495,41 @@ def convert_pdf_to_word(input_path, output_path):
         print(f"Error converting PDF to Word: {e}\n{traceback.format_exc()}")
         raise
 
-def convert_pdf_to_pptx(input_path, output_path, temp_img_dir):
-    """Converts PDF pages to images (PyMuPDF) and inserts into PPTX."""
-    doc = None
+def convert_pdf_to_pptx(input_path, output_path):
+    """Converts PDF pages to images (PyMuPDF) and inserts into PPTX. Images stay in memory."""
     try:
         print(f"Converting PDF to PPTX (as images using PyMuPDF): {input_path} -> {output_path}")
-        os.makedirs(temp_img_dir, exist_ok=True)
-        doc = fitz.open(input_path)
-        if not doc.page_count: raise ValueError("Input PDF has no pages.")
-
-        image_paths = []
         dpi = 150
-        for i, page in enumerate(doc):
-             pix = page.get_pixmap(dpi=dpi)
-             img_path = os.path.join(temp_img_dir, f"slide_{i+1:03d}.png")
-             pix.save(img_path, "png")
-             image_paths.append(img_path)
-        doc.close(); doc = None
-        if not image_paths: raise Exception("PyMuPDF failed to convert pages for PPTX.")
+        slide_images = render_pdf_pages(input_path, dpi, "png")
+        if not slide_images: raise Exception("PyMuPDF failed to convert pages for PPTX.")
 
         prs = Presentation()
         blank_slide_layout = prs.slide_layouts[5]
         slide_width_emu, slide_height_emu = prs.slide_width, prs.slide_height
 
-        for i, img_path in enumerate(image_paths):
-            if not os.path.exists(img_path): continue
+        placements = {} # (width_px, height_px) -> (left, top, width, height) in EMU; pages mostly share one size
+        def place(img_width_px, img_height_px):
+            img_width_emu = img_width_px * EMU_PER_PIXEL
+            img_height_emu = img_height_px * EMU_PER_PIXEL
+            ratio = min(slide_width_emu / img_width_emu, slide_height_emu / img_height_emu) if img_width_emu > 0 and img_height_emu > 0 else 1
+            pic_width_emu = int(img_width_emu * ratio)
+            pic_height_emu = int(img_height_emu * ratio)
+            return (slide_width_emu - pic_width_emu) // 2, (slide_height_emu - pic_height_emu) // 2, pic_width_emu, pic_height_emu
+
+        for i, (png_bytes, img_width_px, img_height_px) in enumerate(slide_images): # Pixel size taken from the pixmap, no PNG re-decode
             slide = prs.slides.add_slide(blank_slide_layout)
             try:
-                with Image.open(img_path) as im: img_width_px, img_height_px = im.size
-                img_width_emu = Emu(img_width_px * 914400 / 96)
-                img_height_emu = Emu(img_height_px * 914400 / 96)
-                ratio = min(slide_width_emu / img_width_emu, slide_height_emu / img_height_emu) if img_width_emu > 0 and img_height_emu > 0 else 1
-                pic_width_emu = int(img_width_emu * ratio)
-                pic_height_emu = int(img_height_emu * ratio)
-                left = int((slide_width_emu - pic_width_emu) / 2)
-                top = int((slide_height_emu - pic_height_emu) / 2)
-                slide.shapes.add_picture(img_path, left, top, width=pic_width_emu, height=pic_height_emu)
-            except Exception as pic_e: print(f"Error adding picture {img_path} to slide {i+1}: {pic_e}")
+                size_px = (img_width_px, img_height_px)
+                if size_px not in placements: placements[size_px] = place(*size_px)
+                left, top, pic_width_emu, pic_height_emu = placements[size_px]
+                slide.shapes.add_picture(io.BytesIO(png_bytes), left, top, width=pic_width_emu, height=pic_height_emu)
+            except Exception as pic_e: print(f"Error adding picture to slide {i+1}: {pic_e}")
 
         prs.save(output_path)
-        print(f"Successfully created PPTX with {len(image_paths)} slides.")
+        print(f"Successfully created PPTX with {len(slide_images)} slides.")
     except Exception as e:
         print(f"Error converting PDF to PPTX: {e}\n{traceback.format_exc()}")
-        if doc: doc.close()
         raise
-    finally:
-        if os.path.exists(temp_img_dir): shutil.rmtree(temp_img_dir, ignore_errors=True)
 
 
 # --- PDF Manipulation Functions ---
@@ -302,30 +540,43 @@ def compress_pdf(input_path, output_path):
         reader = pypdf.PdfReader(input_path)
         writer = pypdf.PdfWriter()
         writer.clone_document_from_reader(reader)
-        for page in writer.pages:
+        # Same steps as page.compress_content_streams(), split so only the deflate runs in parallel:
+        # reading contents and replacing them touch the shared reader/writer and stay on this thread
+        contents = []
+        for page_index, page in enumerate(writer.pages):
              try: # Compression can sometimes fail on complex/corrupt pages
-                  page.compress_content_streams()
-             except Exception as comp_e:
-                  page_index = writer.get_page_number(page) # Get index for logging
-                  print(f"Warning: Could not compress content stream for page {page_index + 1}: {comp_e}")
+                  content = page.get_contents()
+                  if content is not None: content.get_data(); contents.append((page_index, page, content)) # get_data() loads the bytes up front
+             except Exception as comp_e: print(f"Warning: Could not compress content stream for page {page_index + 1}: {comp_e}")
+        workers = min(COMPRESS_WORKERS, len(contents))
+        if workers > 1:
+             with ThreadPoolExecutor(max_workers=workers) as pool: # zlib releases the GIL while deflating
+                  encoders = [pool.submit(content.flate_encode).result for _, _, content in contents]
+        else: # 0-1 streams: a pool would cost more than it saves
+             encoders = [content.flate_encode for _, _, content in contents]
+        for (page_index, page, _), encode in zip(contents, encoders):
+             try: page.replace_contents(encode())
+             except Exception as comp_e: print(f"Warning: Could not compress content stream for page {page_index + 1}: {comp_e}")
+        if hasattr(writer, "compress_identical_objects"): # Newer pypdf: dedupe shared font/image streams
+             writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
         with open(output_path, 'wb') as f: writer.write(f)
         print("Finished compress operation.")
     except Exception as e:
         print(f"Error compressing PDF: {e}\n{traceback.format_exc()}")
         raise
 
-def split_pdf(input_path, output_dir, ranges_str):
-    """Splits PDF based on page ranges using pypdf."""
+def split_pdf(input_path, ranges_str):
+    """Splits PDF based on page ranges using pypdf. Returns [(filename, pdf_bytes)], one per valid range."""
     output_files = []
     try:
         print(f"Splitting PDF: {input_path} based on ranges '{ranges_str}'")
-        os.makedirs(output_dir, exist_ok=True)
         reader = pypdf.PdfReader(input_path)
         num_pages = len(reader.pages)
         if num_pages == 0: raise ValueError("Input PDF has no pages to split.")
 
         parts = ranges_str.split(',')
         file_index = 1
+        safe_base = safe_name(os.path.basename(input_path), _SAFE_NAME_ALNUM)
         for part in parts:
             part = part.strip()
             if not part: continue
@@ -337,18 +588,19 @@ def split_pdf(input_path, output_dir, ranges_str):
                     start = int(start_str) if start_str else 1
                     end = int(end_str) if end_str else num_pages
                     if not (1 <= start <= end <= num_pages): raise ValueError(f"Range {start}-{end} out of bounds (1-{num_pages})")
-                    for i in range(start - 1, end): writer.add_page(reader.pages[i]); pages_added = True
+                    writer.append(reader, pages=(start - 1, end), import_outline=False) # One range copy instead of per-page add_page()
                 else:
                     page_num = int(part)
                     if not (1 <= page_num <= num_pages): raise ValueError(f"Page number {page_num} out of bounds (1-{num_pages})")
-                    writer.add_page(reader.pages[page_num - 1]); pages_added = True
+                    writer.append(reader, pages=[page_num - 1], import_outline=False)
+                pages_added = len(writer.pages) > 0
 
                 if pages_added:
-                    safe_base = "".join(c if c.isalnum() else "_" for c in os.path.basename(input_path))
-                    output_filename = os.path.join(output_dir, f"split_{file_index}_{safe_base}.pdf")
-                    with open(output_filename, 'wb') as f: writer.write(f)
-                    output_files.append(output_filename)
-                    print(f"Created split file: {output_filename}")
+                    output_filename = f"split_{file_index}_{safe_base}.pdf"
+                    part_buffer = io.BytesIO()
+                    writer.write(part_buffer)
+                    output_files.append((output_filename, part_buffer.getvalue()))
+                    print(f"Created split part: {output_filename}")
                     file_index += 1
                 else: print(f"Warning: Range '{part}' resulted in no pages being added.") # Should not happen if logic is correct
             except (ValueError, IndexError) as parse_err:
@@ -365,35 +617,24 @@ def split_pdf(input_path, output_dir, ranges_str):
 
 
 def merge_pdfs(input_zip_path, output_path):
-    """Merges multiple PDFs from a zip file using pypdf."""
-    temp_extract_dir = os.path.join(tempfile.gettempdir(), f"merge_{os.path.basename(output_path)}_extracted_{os.getpid()}")
+    """Merges multiple PDFs from a zip file using pypdf. Members are read straight from the zip, nothing is extracted."""
     merger = None
-    extracted_files = [] # Keep track for cleanup
     try:
         print(f"Merging PDFs from zip: {input_zip_path} -> {output_path}")
-        os.makedirs(temp_extract_dir, exist_ok=True)
-
-        pdf_files_to_merge = []
         with zipfile.ZipFile(input_zip_path, 'r') as zip_ref:
-            for member in zip_ref.infolist():
-                if member.is_dir() or not member.filename.lower().endswith('.pdf') or '../' in member.filename: continue
-                target_path = os.path.join(temp_extract_dir, os.path.basename(member.filename))
+            members = [member for member in zip_ref.infolist()
+                       if not member.is_dir() and member.filename.lower().endswith('.pdf') and '../' not in member.filename]
+            if not members: raise ValueError("No valid PDF files found in the zip archive.")
+            members.sort(key=lambda member: os.path.basename(member.filename)) # Sort for predictable order
+
+            merger = pypdf.PdfWriter() # Same append() as the removed PdfMerger
+            print("Appending PDFs...")
+            for member in members:
+                name = os.path.basename(member.filename)
                 try:
-                     with zip_ref.open(member.filename) as source, open(target_path, "wb") as target:
-                         shutil.copyfileobj(source, target)
-                     extracted_files.append(target_path) # Add to cleanup list
-                     pdf_files_to_merge.append(target_path)
-                     print(f"Extracted for merging: {os.path.basename(target_path)}")
-                except Exception as extract_e: print(f"Warning: Failed to extract {member.filename}: {extract_e}")
-
-        if not pdf_files_to_merge: raise ValueError("No valid PDF files found or extracted from the zip archive.")
-        pdf_files_to_merge.sort() # Sort for predictable order
-
-        merger = pypdf.PdfMerger()
-        print("Appending PDFs...")
-        for pdf_path in pdf_files_to_merge:
-            try: merger.append(pdf_path); print(f"Appended: {os.path.basename(pdf_path)}")
-            except Exception as append_e: print(f"Warning: Could not append PDF '{os.path.basename(pdf_path)}'. Skipping. Error: {append_e}")
+                    with zip_ref.open(member) as source: data = source.read()
+                    merger.append(io.BytesIO(data)); print(f"Appended: {name}") # pypdf needs a seekable stream
+                except Exception as append_e: print(f"Warning: Could not append PDF '{name}'. Skipping. Error: {append_e}")
 
         if len(merger.pages) == 0: raise Exception("Merging resulted in an empty PDF. Check input files and logs.")
 
@@ -405,10 +646,6 @@ def merge_pdfs(input_zip_path, output_path):
         print(f"Error merging PDFs: {e}\n{traceback.format_exc()}")
         if merger: merger.close() # Ensure close on error
         raise
-    finally:
-        if os.path.exists(temp_extract_dir):
-            print(f"Cleaning up temporary merge directory: {temp_extract_dir}")
-            shutil.rmtree(temp_extract_dir, ignore_errors=True)
 
 
 def rotate_pdf(input_path, output_path, pages_str, angle):
@@ -419,7 +656,6 @@ def rotate_pdf(input_path, output_path, pages_str, angle):
         if angle % 90 != 0: raise ValueError("Rotation angle must be a multiple of 90.")
 
         reader = pypdf.PdfReader(input_path)
-        writer = pypdf.PdfWriter()
         num_pages = len(reader.pages)
         if num_pages == 0: raise ValueError("Input PDF has no pages to rotate.")
 
@@ -445,13 +681,18 @@ def rotate_pdf(input_path, output_path, pages_str, angle):
                         rotate_indices.add(page_num - 1)
                 except ValueError as parse_err: raise ValueError(f"Invalid page specification '{part}': {parse_err}")
 
-        if not rotate_indices: print("Warning: No pages selected for rotation based on input.")
+        if not rotate_indices or angle % 360 == 0:
+            print("Warning: No pages selected for rotation based on input." if not rotate_indices else "Rotation is a full turn, nothing to do.")
+            shutil.copyfile(input_path, output_path) # Output would be identical: skip the clone and re-serialization
+            return
 
-        writer.clone_document_from_reader(reader) # Clone first
+        writer = pypdf.PdfWriter() # Only created once there is something to rotate
+        writer.clone_document_from_reader(reader) # Single clone; rotation only rewrites /Rotate on the cloned pages
+        writer_pages = writer.pages
         rotated_count = 0
-        for i in rotate_indices:
-             if 0 <= i < len(writer.pages):
-                 writer.pages[i].rotate(angle)
+        for i in sorted(rotate_indices): # Page order: each page dictionary is touched once, sequentially
+             if 0 <= i < num_pages:
+                 writer_pages[i].rotate(angle)
                  rotated_count += 1
              else: print(f"Warning: Index {i} from selection is out of bounds, skipping.")
         print(f"Rotated {rotated_count} pages by {angle} degrees")
@@ -472,19 +713,25 @@ def add_page_numbers_to_pdf(input_path, output_path, position):
         num_pages = len(reader.pages)
         if num_pages == 0: raise ValueError("Input PDF has no pages to add numbers to.")
 
-        added_count = 0
+        # One ReportLab canvas for all overlays (one page each, sized to match), parsed once by pypdf
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pageCompression=0) # Throwaway overlay: pypdf re-serializes it anyway, skip the deflate
+        font_size = 9
+        margin = 0.5 * inch
+        # Helvetica digits share one advance width, so "Page X of N" is measured once instead of per page
+        base_text_width = can.stringWidth("Page  of ", "Helvetica", font_size)
+        digit_width = can.stringWidth("0", "Helvetica", font_size)
+        total_digits = len(str(num_pages))
+        numbered = [] # Per page: True if its overlay page carries a number
         for i, page in enumerate(reader.pages):
-            packet = io.BytesIO()
             try:
                 page_width = float(page.mediabox.width)
                 page_height = float(page.mediabox.height)
-                can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+                can.setPageSize((page_width, page_height))
 
                 page_num_text = f"Page {i + 1} of {num_pages}"
-                font_size = 9
-                can.setFont("Helvetica", font_size)
-                text_width = can.stringWidth(page_num_text, "Helvetica", font_size)
-                margin = 0.5 * inch
+                can.setFont("Helvetica", font_size) # Font state resets with every showPage()
+                text_width = base_text_width + digit_width * (len(str(i + 1)) + total_digits)
 
                 x = (page_width - text_width) / 2; y = margin # Default bottom-center
                 if position == 'bottom-left': x = margin
@@ -494,16 +741,25 @@ def add_page_numbers_to_pdf(input_path, output_path, position):
                 elif position == 'top-right': x = page_width - text_width - margin; y = page_height - margin - font_size
 
                 can.drawString(x, y, page_num_text)
-                can.save()
-                packet.seek(0)
+                numbered.append(True)
+            except Exception as overlay_e:
+                 print(f"Warning: Could not create overlay for page {i+1}: {overlay_e}")
+                 numbered.append(False)
+            can.showPage() # Always emit a page so overlay page i stays aligned with input page i
+        can.save()
+        packet.seek(0)
+        overlay_pages = pypdf.PdfReader(packet).pages
 
-                overlay_pdf = pypdf.PdfReader(packet)
-                if overlay_pdf.pages:
-                     page.merge_page(overlay_pdf.pages[0])
+        added_count = 0
+        for i, page in enumerate(reader.pages):
+            try:
+                if not numbered[i]: continue # Warned above; the finally still adds the page
+                if i < len(overlay_pages):
+                     page.merge_page(overlay_pages[i])
                      added_count += 1
                 else: print(f"Warning: ReportLab overlay for page {i+1} was empty.")
             except Exception as overlay_e:
-                 print(f"Warning: Could not create or merge overlay for page {i+1}: {overlay_e}")
+                 print(f"Warning: Could not merge overlay for page {i+1}: {overlay_e}")
                  # Add the original page anyway
             finally:
                  writer.add_page(page) # Add original or merged page
@@ -516,247 +772,386 @@ def add_page_numbers_to_pdf(input_path, output_path, position):
         raise
 
 
+# --- Result Archives ---
+# Entries are JPEG images or PDF files, whose data is already compressed, so zips are stored by default.
+# A client can still ask for compression in the request options ("zip_compression").
+ZIP_COMPRESSION = {
+    "stored": (zipfile.ZIP_STORED, None),
+    "deflate": (zipfile.ZIP_DEFLATED, 1), # Fastest level: squeezes PDF structure without stalling the response
+}
+if hasattr(zipfile, "ZIP_ZSTANDARD"): ZIP_COMPRESSION["zstd"] = (zipfile.ZIP_ZSTANDARD, 3) # Python 3.14+
+
+def write_result_zip(target, created_files, compression="stored"):
+    """Writes [(name, data)] entries into a zip at target (path or binary file object). Returns the entry count."""
+    method, level = ZIP_COMPRESSION.get(compression, ZIP_COMPRESSION["stored"]) # Unknown/unsupported: stored
+    with zipfile.ZipFile(target, 'w', method, compresslevel=level) as zipf:
+        for name, data in created_files: zipf.writestr(name, data)
+    return len(created_files)
+
+
+# --- PDF Action Worker Pool ---
+# pypdf, pdf2docx and reportlab are pure Python and hold the GIL: PDF actions run in worker processes so concurrent requests
+# really compute in parallel. pdf_to_jpg/pdf_to_pptx keep their own page-level render pool, Office conversions their COM pool.
+_action_pool = None
+_action_pool_lock = threading.Lock()
+
+def run_pdf_action(func, *args):
+    """Runs a PDF action in the worker pool and waits for it. Restarts the pool once if a worker died."""
+    global _action_pool
+    with _action_pool_lock:
+        if _action_pool is None: # Created on first use
+            _action_pool = ProcessPoolExecutor(max_workers=ACTION_WORKERS, mp_context=WORKER_CONTEXT)
+            print(f"PDF action worker pool started ({ACTION_WORKERS} processes)")
+        pool = _action_pool
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        with _action_pool_lock:
+            if _action_pool is pool: # Only the first thread to notice restarts it
+                print("PDF action worker pool broken (worker crashed), restarting it...")
+                _action_pool = ProcessPoolExecutor(max_workers=ACTION_WORKERS, mp_context=WORKER_CONTEXT)
+            pool = _action_pool
+        return pool.submit(func, *args).result()
+
+
+# --- Action Dispatch ---
+# action -> handler(input_path, output_path, options, input_ext). File actions write output_path;
+# STREAMED_ACTIONS return [(name, data)] instead, which is zipped straight into the socket.
+ACTION_HANDLERS = {
+    "convert": lambda input_path, output_path, options, input_ext: handle_file_conversion(input_ext, input_path, output_path),
+    "encrypt": lambda input_path, output_path, options, input_ext: run_pdf_action(encrypt_pdf, input_path, output_path, options["password"]),
+    "decrypt": lambda input_path, output_path, options, input_ext: run_pdf_action(decrypt_pdf, input_path, output_path, options["password"]),
+    "pdf_to_jpg": lambda input_path, output_path, options, input_ext: convert_pdf_to_jpg(input_path),
+    "pdf_to_word": lambda input_path, output_path, options, input_ext: run_pdf_action(convert_pdf_to_word, input_path, output_path),
+    "pdf_to_pptx": lambda input_path, output_path, options, input_ext: convert_pdf_to_pptx(input_path, output_path),
+    "compress": lambda input_path, output_path, options, input_ext: run_pdf_action(compress_pdf, input_path, output_path),
+    "split": lambda input_path, output_path, options, input_ext: run_pdf_action(split_pdf, input_path, options["ranges"]),
+    "merge": lambda input_path, output_path, options, input_ext: run_pdf_action(merge_pdfs, input_path, output_path), # Input is the received zip
+    "rotate": lambda input_path, output_path, options, input_ext: run_pdf_action(rotate_pdf, input_path, output_path, options["pages"], options["angle"]),
+    "add_numbers": lambda input_path, output_path, options, input_ext: run_pdf_action(add_page_numbers_to_pdf, input_path, output_path, options["position"]),
+}
+STREAMED_ACTIONS = frozenset(("pdf_to_jpg", "split"))
+
+
 # --- Main Server Logic ---
+# Uploads and results live only for the duration of a request: keep them in RAM (tmpfs) where the OS offers it
+SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+_request_ids = itertools.count(1) # Output names never repeat, so a pending background removal cannot hit a newer file
+_cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cleanup") # Unlinks finished requests' files off the request path
+
+def remove_request_files(paths):
+    """Removes a finished request's temporary files (runs on the cleanup thread)."""
+    for path in paths:
+        try: os.remove(path); print(f"Removed file: {path}")
+        except FileNotFoundError: pass # Never created (e.g. the action failed before writing its output)
+        except OSError as e_rem: print(f"Warning: Error removing file {path}: {e_rem}")
+
+def handle_request(conn, rfile, addr):
+    """Handles one request on a connection. Returns True if the connection can serve another request.
+    All reads go through rfile, the connection's buffered reader, so small framing fields and tokens
+    are served from its buffer instead of costing a recv() syscall each; writes use conn directly."""
+    input_path = None
+    output_path = None
+    received_zip_path = None
+    output_file = None
+    action_success = False
+    action = "unknown" # Default action for logging errors early
+    keep_alive = False
+
+    # Wait for the next request on this (keep-alive) connection
+    conn.settimeout(60.0) # Idle timeout between requests
+    try:
+        header_prefix = rfile.read(4) # Short only at EOF
+    except (socket.timeout, ConnectionResetError, ConnectionAbortedError):
+        print(f"Closing idle connection from {addr}.")
+        return False
+    if not header_prefix: return False # Client closed the connection between requests
+
+    print(f"\n--- New request from {addr} ---")
+    try:
+        # 1. Get Request Header (4-byte length prefix + JSON: action, filename, size, options)
+        if len(header_prefix) < 4: raise ConnectionAbortedError("Client disconnected mid-header.")
+        header_len = struct.unpack("!I", header_prefix)[0]
+        if header_len > MAX_HEADER_SIZE: raise ConnectionAbortedError(f"Request header too large ({header_len} bytes).")
+        header = json.loads(recv_exact(rfile, header_len).decode())
+        action = str(header.get("action", "")).strip()
+        base_filename = str(header.get("filename", ""))
+        size = header.get("size", 0)
+        options = header.get("options") or {} # Dictionary to hold options
+        print(f"Received action: {action}")
+        print(f"Received base filename: {base_filename}")
+        if not isinstance(size, int) or isinstance(size, bool) or (size < 0 and size != CHUNKED_SIZE):
+            # The body length is unknown, so the connection cannot be resynchronized: reply and close
+            print(f"! Bad request from {addr}: invalid body size {size!r}")
+            conn.sendall(ERROR_BAD_REQUEST_NAME + EMPTY_SIZE + f"ERROR: Invalid request size {size!r}.".encode())
+            return keep_alive
+        print(f"Expecting file size: {size} bytes")
+
+        if action == "ping": # Keep-alive liveness check from a pooled client connection (one answer_ping() did not take)
+            conn.sendall(PONG)
+            keep_alive = True
+            return keep_alive
+        if action == "bye": # Client is done with this connection (e.g. closing its pool)
+            print(f"Client {addr} said goodbye.")
+            return keep_alive
+
+        # --- Setup Paths ---
+        temp_dir = SCRATCH_DIR
+        input_filename_base, input_ext = os.path.splitext(base_filename)
+        safe_base = safe_name(input_filename_base)[:50] # Limit length
+        pid_suffix = f"_{os.getpid()}_{next(_request_ids)}" # Unique per request
+
+        input_suffix = ".zip" if action == "merge" else input_ext # Input file itself is created by mkstemp() below
+
+        # Define output path/suggestion (will be created by the action function)
+        output_filename_suggestion = f"{safe_base}_processed.pdf" # Default
+        streamed_files = None # [(name, data)] zipped straight into the socket instead of an output file
+        if action == "pdf_to_jpg":
+            output_filename_suggestion = f"{safe_base}_images.zip"
+        # ... (other specific actions as before) ...
+        elif action == "pdf_to_word":
+            output_path = os.path.join(temp_dir, f"{safe_base}{pid_suffix}.docx")
+            output_filename_suggestion = f"{safe_base}.docx"
+        elif action == "pdf_to_pptx":
+             output_path = os.path.join(temp_dir, f"{safe_base}{pid_suffix}.pptx")
+             output_filename_suggestion = f"{safe_base}.pptx"
+        elif action == "split":
+            output_filename_suggestion = f"{safe_base}_split_files.zip"
+        elif action == "merge":
+             output_filename_base = f"merged_{input_filename_base}"[:50] # Limit merged name length
+             output_path = os.path.join(temp_dir, f"{output_filename_base}{pid_suffix}.pdf")
+             output_filename_suggestion = f"{output_filename_base}.pdf"
+        else: # Standard PDF output actions
+            suffix = action if action != "convert" else "processed"
+            output_filename_base = f"{safe_base}_{suffix}"
+            output_path = os.path.join(temp_dir, f"{output_filename_base}{pid_suffix}.pdf")
+            output_filename_suggestion = f"{output_filename_base}.pdf"
+        # --- End Path Setup ---
+
+        # 2. Receive File Data
+        # mkstemp(): unique name created atomically (O_EXCL) and already open, so concurrent clients never collide
+        input_fd, input_path = tempfile.mkstemp(suffix=input_suffix, prefix=f"{safe_base}_", dir=temp_dir)
+        if action == "merge": received_zip_path = input_path
+        print(f"Receiving data into: {input_path}...")
+        conn.settimeout(120.0) # Adjust timeout for potentially large file transfer
+        with os.fdopen(input_fd, "wb", buffering=0) as f:
+            received_bytes = recv_body_to_file(rfile, f, size, recv_buffer()) # Reused across requests on this worker
+        conn.settimeout(600.0) # Reset longer timeout for processing
+        print(f"Received {received_bytes} bytes and saved to {input_path}")
+        if size != CHUNKED_SIZE and received_bytes != size: print(f"Warning: Received bytes ({received_bytes}) differs from expected size ({size}).")
+
+        # --- Check Extra Options (sent inside the header) ---
+        if action in ("encrypt", "decrypt"):
+            if options.get("password") is None: raise ValueError("No password received.")
+            print("Received password.")
+        elif action == "split":
+            if not options.get("ranges"): raise ValueError("No split ranges received.")
+            print(f"Received ranges: {options['ranges']}")
+        elif action == "rotate":
+            if not options.get("pages"): raise ValueError("No rotate pages received.")
+            if options.get("angle") is None: raise ValueError("No rotate angle received.")
+            print(f"Received pages: {options['pages']}")
+            print(f"Received angle: {options['angle']}")
+        elif action == "add_numbers":
+            if not options.get("position"): raise ValueError("No position received.")
+            print(f"Received position: {options['position']}")
+        # --- End Checking Options ---
+
+        # --- Execute Action ---
+        print(f"--- Starting Action: {action} ---")
+        handler = ACTION_HANDLERS.get(action)
+        if handler is None: raise ValueError(f"Invalid action received from client: {action}")
+        result = handler(input_path, output_path, options, input_ext)
+        if action in STREAMED_ACTIONS: streamed_files = result # Zipped while sending
+
+        action_success = True # Mark action as successful
+        print(f"--- Action {action} Completed Successfully ---")
+        # --- End Execute Action ---
+
+        # --- Send Result ---
+        if streamed_files is None:
+            try: output_file = open(output_path, "rb") # Opened once: existence, size (fstat) and data all come from this handle
+            except FileNotFoundError: raise FileNotFoundError(f"Output file was not created by action '{action}': {output_path}") from None
+
+        # 3./4. Send Output Filename Suggestion, File Size and Data (length-prefixed, no ACKs: they leave together with the first data)
+        result_name = name_frame(output_filename_suggestion)
+        if streamed_files is not None: # Zip entries go out as they are written: no zip file on disk, no second pass
+            print(f"Streaming {len(streamed_files)} files zipped as {output_filename_suggestion} to {addr}")
+            body = _ChunkedWriter(conn, head=result_name + CHUNKED_RESULT_MARK) # Name and size marker leave with the first chunk
+            write_result_zip(body, streamed_files, options.get("zip_compression", "stored"))
+            body.close() # Sends the terminating zero-length chunk
+            print(f"Finished sending {body.bytes_sent} bytes.")
+        else:
+            output_size = os.fstat(output_file.fileno()).st_size
+            size_prefix = result_name + struct.pack("!Q", output_size) # 8-byte big-endian size
+            print(f"Sending {output_size} bytes of {output_filename_suggestion} to {addr}")
+            with output_file as f, corked(conn):
+                if hasattr(os, "sendfile"):
+                    conn.sendall(size_prefix) # Name and size, held back by the cork until the file data joins them
+                    bytes_sent = conn.sendfile(f, 0, output_size) if output_size else 0 # Zero-copy: kernel moves file pages to the socket (count must be > 0)
+                else: # No os.sendfile (Windows): socket.sendfile() would fall back to 8 KiB sends, use large chunks instead
+                    bytes_sent = send_file_mapped(conn, f, size_prefix, output_size)
+            print(f"Finished sending {bytes_sent} bytes.")
+        keep_alive = True # Response fully sent, connection can take another request
+        # --- End Send Result ---
+
+    except (ConnectionAbortedError, ConnectionResetError, socket.timeout) as net_err:
+         print(f"! Network Error for {addr} during action '{action}': {net_err}")
+    except FileNotFoundError as fnfe:
+         print(f"! File Not Found Error for {addr} during action '{action}': {fnfe}")
+         # Attempt to send specific error
+         try:
+             conn.sendall(ERROR_FILE_NOT_FOUND_NAME + EMPTY_SIZE + f"ERROR: File not found on server. {fnfe}".encode()) # Name, size 0, then the message
+         except Exception as e_send: print(f"Failed to send file not found error to client: {e_send}")
+    except Exception as e:
+        print(f"!!! Error processing request from {addr} for action '{action}': {e}")
+        traceback.print_exc() # Print full traceback
+        if not action_success: # Only send general error if action itself failed
+            try:
+                # Send general error signal
+                error_msg_client = f"ERROR: Server failed during action '{action}'. Check server logs. Details: {str(e)[:200]}"
+                conn.sendall(ERROR_PROCESSING_NAME + EMPTY_SIZE + error_msg_client.encode()) # Name, size 0, then the message
+            except Exception as e_send: print(f"Failed to send processing error to client: {e_send}")
+
+    finally:
+        # --- Cleanup ---
+        print("--- Cleaning up temporary files ---")
+        if output_file: output_file.close() # No-op after a completed send; an open handle would block removal on Windows
+        paths_to_remove = [input_path, output_path]
+        # Add specific merge cleanup path if action was merge
+        if action == "merge" and received_zip_path and received_zip_path != input_path:
+             paths_to_remove.append(received_zip_path)
+        paths_to_remove = [path for path in paths_to_remove if path]
+        if paths_to_remove: _cleanup_pool.submit(remove_request_files, paths_to_remove) # The connection is handed back without waiting
+        # --- End Cleanup ---
+        print(f"--- Request from {addr} finished ---")
+    return keep_alive
+
+
+# --- Connection Event Loop ---
+# One selector thread owns every socket. Idle keep-alive connections cost only a selector entry; a connection
+# with a request waiting is handed to a worker thread, which runs handle_request() on it and hands it back.
+MAX_ACTIVE_REQUESTS = 16 # Worker threads: requests processed at once
+MAX_CONNECTIONS = 256 # Open connections (Windows select() is limited to 512 sockets)
+IDLE_TIMEOUT = 60.0 # Close keep-alive connections idle for longer than this
+IDLE_SWEEP_INTERVAL = 5.0
+LISTEN_BACKLOG = 1024 # Pending handshakes queued by the OS during bursts (clamped to somaxconn)
+FASTOPEN_QUEUE = 256 # Pending TCP Fast Open requests (request header carried in the SYN)
+
+def serve_ready_request(conn, rfile, addr, hand_back):
+    """Worker thread: handles the request waiting on conn, then returns the connection to the event loop."""
+    keep_alive = False
+    try:
+        keep_alive = handle_request(conn, rfile, addr)
+    except Exception as e:
+        print(f"!!! Unexpected error on connection {addr}: {e}\n{traceback.format_exc()}")
+    finally:
+        hand_back(conn, rfile, addr, keep_alive)
+
+def answer_ping(conn):
+    """Event loop: answers a PING waiting on a parked connection without a worker, so pool liveness checks never queue
+    behind running conversions. Returns True if it did; anything else waiting is left unread for handle_request()."""
+    conn.setblocking(False) # The event loop must never wait on one client
+    try:
+        if conn.recv(len(PING_REQUEST), socket.MSG_PEEK) != PING_REQUEST: return False
+        conn.recv(len(PING_REQUEST)) # Parked connections have nothing buffered in rfile, so the socket can be read directly
+        conn.sendall(PONG) # 4 bytes into an idle connection's send buffer
+        return True
+    except OSError: return False # BlockingIOError or a broken connection: the worker path deals with it
+    finally: conn.setblocking(True)
+
+def close_connection(conn, rfile, addr):
+    try: rfile.close()
+    finally: conn.close()
+    print(f"--- Connection with {addr} closed ---")
+
 def server_program():
     HOST = '127.0.0.1'
     PORT = 65432
 
+    selector = selectors.DefaultSelector()
+    wake_recv, wake_send = socket.socketpair() # Lets workers interrupt select() when they hand a connection back
+    wake_recv.setblocking(False)
+    returned = queue.SimpleQueue() # (conn, rfile, addr, keep_alive) from workers; only this thread touches the selector
+    idle = {} # conn -> (rfile, addr, parked_at)
+    busy = 0 # Connections currently inside a worker
+    workers = ThreadPoolExecutor(max_workers=MAX_ACTIVE_REQUESTS, thread_name_prefix="request")
+
+    def hand_back(conn, rfile, addr, keep_alive):
+        returned.put((conn, rfile, addr, keep_alive))
+        wake_send.send(b"\0")
+
+    def park(conn, rfile, addr):
+        # The protocol is strict request/response: once a response is sent, rfile holds no buffered bytes,
+        # so socket readability is a reliable "next request waiting" signal
+        idle[conn] = (rfile, addr, time.monotonic())
+        selector.register(conn, selectors.EVENT_READ)
+
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Allow address reuse
+        # Set before listen(): accepted sockets inherit the buffers, and the TCP window scale is fixed at the handshake
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        if hasattr(socket, "TCP_FASTOPEN"): # Linux, recent Windows: a returning client's first request skips the handshake RTT
+            try: s.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, FASTOPEN_QUEUE)
+            except OSError as e: print(f"TCP Fast Open unavailable: {e}")
         s.bind((HOST, PORT))
-        s.listen()
+        s.listen(LISTEN_BACKLOG)
+        s.setblocking(False)
         print(f"Server listening on {HOST}:{PORT}")
+        rcvbuf, sndbuf = s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        print(f"Socket buffers: receive {rcvbuf} / send {sndbuf} bytes (requested {SOCKET_BUFFER_SIZE})") # The OS may clamp (Linux: net.core.rmem_max/wmem_max) or double them
+        start_office_pool()
+        selector.register(s, selectors.EVENT_READ)
+        selector.register(wake_recv, selectors.EVENT_READ)
+        accepting = True
+        last_sweep = time.monotonic()
 
-        while True:
-            conn, addr = s.accept()
-            # Set timeouts for the connection
-            conn.settimeout(60.0) # General timeout
-            with conn:
-                print(f"\n--- New connection from {addr} ---")
-                input_path = None
-                output_path = None
-                temp_dir_for_action = None
-                received_zip_path = None
-                action_success = False
-                action = "unknown" # Default action for logging errors early
-
-                try:
-                    # 1. Get Action
-                    action_bytes = conn.recv(1024)
-                    if not action_bytes: raise ConnectionAbortedError("Client disconnected before sending action.")
-                    action = action_bytes.decode().strip()
-                    conn.sendall(b"ACK_ACTION")
-                    print(f"Received action: {action}")
-
-                    # 2. Get Input Filename
-                    base_filename_bytes = conn.recv(1024)
-                    if not base_filename_bytes: raise ConnectionAbortedError("Client disconnected before sending filename.")
-                    base_filename = base_filename_bytes.decode()
-                    conn.sendall(b"ACK_FILENAME")
-                    print(f"Received base filename: {base_filename}")
-
-                    # --- Setup Paths ---
-                    temp_dir = tempfile.gettempdir()
-                    input_filename_base, input_ext = os.path.splitext(base_filename)
-                    safe_base = "".join(c if c.isalnum() or c in ['_', '-'] else '_' for c in input_filename_base)[:50] # Limit length
-                    pid_suffix = f"_{os.getpid()}"
-
-                    if action == "merge":
-                         input_path = os.path.join(temp_dir, f"{safe_base}{pid_suffix}.zip")
-                         received_zip_path = input_path
-                    else:
-                         input_path = os.path.join(temp_dir, f"{safe_base}{pid_suffix}{input_ext}")
-
-                    # Define output path/suggestion (will be created by the action function)
-                    output_filename_suggestion = f"{safe_base}_processed.pdf" # Default
-                    if action == "pdf_to_jpg":
-                        temp_dir_for_action = os.path.join(temp_dir, f"{safe_base}_jpg_output{pid_suffix}")
-                        output_path = os.path.join(temp_dir, f"{safe_base}_images{pid_suffix}.zip")
-                        output_filename_suggestion = f"{safe_base}_images.zip"
-                    # ... (other specific actions as before) ...
-                    elif action == "pdf_to_word":
-                        output_path = os.path.join(temp_dir, f"{safe_base}{pid_suffix}.docx")
-                        output_filename_suggestion = f"{safe_base}.docx"
-                    elif action == "pdf_to_pptx":
-                         temp_dir_for_action = os.path.join(temp_dir, f"{safe_base}_pptx_temp_imgs{pid_suffix}")
-                         output_path = os.path.join(temp_dir, f"{safe_base}{pid_suffix}.pptx")
-                         output_filename_suggestion = f"{safe_base}.pptx"
-                    elif action == "split":
-                        temp_dir_for_action = os.path.join(temp_dir, f"{safe_base}_split_output{pid_suffix}")
-                        output_path = os.path.join(temp_dir, f"{safe_base}_split_files{pid_suffix}.zip")
-                        output_filename_suggestion = f"{safe_base}_split_files.zip"
-                    elif action == "merge":
-                         output_filename_base = f"merged_{input_filename_base}"[:50] # Limit merged name length
-                         output_path = os.path.join(temp_dir, f"{output_filename_base}{pid_suffix}.pdf")
-                         output_filename_suggestion = f"{output_filename_base}.pdf"
-                    else: # Standard PDF output actions
-                        suffix = action if action != "convert" else "processed"
-                        output_filename_base = f"{safe_base}_{suffix}"
-                        output_path = os.path.join(temp_dir, f"{output_filename_base}{pid_suffix}.pdf")
-                        output_filename_suggestion = f"{output_filename_base}.pdf"
-                    # --- End Path Setup ---
-
-                    # 3. Get File Size
-                    size_bytes = conn.recv(16)
-                    if not size_bytes: raise ConnectionAbortedError("Client disconnected before sending size.")
-                    size = int(size_bytes.decode().strip())
-                    conn.sendall(b"ACK_SIZE")
-                    print(f"Expecting file size: {size} bytes")
-
-                    # 4. Receive File Data
-                    print(f"Receiving data into: {input_path}...")
-                    received_bytes = 0
-                    with open(input_path, "wb") as f:
-                        while received_bytes < size:
-                            # Adjust timeout for potentially large file transfer
-                            conn.settimeout(120.0) # 2 minutes per chunk read?
-                            chunk = conn.recv(min(65536, size - received_bytes))
-                            if not chunk: raise ConnectionAbortedError(f"Client disconnected during file transfer ({received_bytes}/{size} received).")
-                            f.write(chunk)
-                            received_bytes += len(chunk)
-                    conn.settimeout(600.0) # Reset longer timeout for processing
-                    print(f"Received {received_bytes} bytes and saved to {input_path}")
-                    if received_bytes != size: print(f"Warning: Received bytes ({received_bytes}) differs from expected size ({size}).")
-
-                    # --- Receive Extra Options ---
-                    options = {} # Dictionary to hold options
-                    if action in ("encrypt", "decrypt"):
-                        print("Waiting for password...")
-                        pass_bytes = conn.recv(1024); conn.sendall(b"ACK_PASS")
-                        if not pass_bytes: raise ConnectionAbortedError("No password received.")
-                        options["password"] = pass_bytes.decode()
-                        print("Received password.")
-                    elif action == "split":
-                        print("Waiting for split ranges...")
-                        ranges_bytes = conn.recv(1024); conn.sendall(b"ACK_RANGES")
-                        if not ranges_bytes: raise ConnectionAbortedError("No split ranges received.")
-                        options["ranges"] = ranges_bytes.decode()
-                        print(f"Received ranges: {options['ranges']}")
-                    elif action == "rotate":
-                        print("Waiting for rotate pages...")
-                        pages_bytes = conn.recv(1024); conn.sendall(b"ACK_PAGES")
-                        if not pages_bytes: raise ConnectionAbortedError("No rotate pages received.")
-                        options["pages"] = pages_bytes.decode()
-                        print(f"Received pages: {options['pages']}")
-                        print("Waiting for rotate angle...")
-                        angle_bytes = conn.recv(1024); conn.sendall(b"ACK_ANGLE")
-                        if not angle_bytes: raise ConnectionAbortedError("No rotate angle received.")
-                        options["angle"] = angle_bytes.decode()
-                        print(f"Received angle: {options['angle']}")
-                    elif action == "add_numbers":
-                        print("Waiting for page number position...")
-                        pos_bytes = conn.recv(1024); conn.sendall(b"ACK_POSITION")
-                        if not pos_bytes: raise ConnectionAbortedError("No position received.")
-                        options["position"] = pos_bytes.decode()
-                        print(f"Received position: {options['position']}")
-                    # --- End Receiving Options ---
-
-                    # --- Execute Action ---
-                    print(f"--- Starting Action: {action} ---")
-                    if action == "convert":
-                        handle_file_conversion(input_ext, input_path, output_path)
-                    elif action == "encrypt":
-                        encrypt_pdf(input_path, output_path, options["password"])
-                    elif action == "decrypt":
-                        decrypt_pdf(input_path, output_path, options["password"])
-                    elif action == "pdf_to_jpg":
-                        created_files = convert_pdf_to_jpg(input_path, temp_dir_for_action)
-                        print(f"Zipping {len(created_files)} JPGs into: {output_path}")
-                        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            for file in created_files: zipf.write(file, os.path.basename(file))
-                        print(f"Finished zipping JPGs.")
-                    elif action == "pdf_to_word":
-                        convert_pdf_to_word(input_path, output_path)
-                    elif action == "pdf_to_pptx":
-                         convert_pdf_to_pptx(input_path, output_path, temp_dir_for_action)
-                    elif action == "compress":
-                        compress_pdf(input_path, output_path)
-                    elif action == "split":
-                        created_files = split_pdf(input_path, temp_dir_for_action, options["ranges"])
-                        print(f"Zipping {len(created_files)} split PDFs into: {output_path}")
-                        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            for file in created_files: zipf.write(file, os.path.basename(file))
-                        print(f"Finished zipping split PDFs.")
-                    elif action == "merge":
-                         merge_pdfs(received_zip_path, output_path)
-                    elif action == "rotate":
-                        rotate_pdf(input_path, output_path, options["pages"], options["angle"])
-                    elif action == "add_numbers":
-                        add_page_numbers_to_pdf(input_path, output_path, options["position"])
-                    else:
-                        raise ValueError(f"Invalid action received from client: {action}")
-
-                    action_success = True # Mark action as successful
-                    print(f"--- Action {action} Completed Successfully ---")
-                    # --- End Execute Action ---
-
-                    # --- Send Result ---
-                    if not os.path.exists(output_path):
-                         raise FileNotFoundError(f"Output file was not created by action '{action}': {output_path}")
-
-                    # 5. Send Output Filename Suggestion
-                    conn.sendall(output_filename_suggestion.encode())
-                    ack = conn.recv(1024) # ACK_OUT_FILENAME
-                    if not ack or ack != b'ACK_OUT_FILENAME': raise ConnectionAbortedError("Client disconnected before ACK filename")
-
-                    # 6. Send Output File Size and Data
-                    output_size = os.path.getsize(output_path)
-                    conn.sendall(str(output_size).encode().ljust(16))
-                    ack = conn.recv(1024) # ACK_OUT_SIZE
-                    if not ack or ack != b'ACK_OUT_SIZE': raise ConnectionAbortedError("Client disconnected before ACK size")
-
-                    print(f"Sending {output_size} bytes of {output_filename_suggestion} to {addr}")
-                    with open(output_path, "rb") as f:
-                        bytes_sent = 0
-                        while True:
-                            chunk = f.read(65536) # Larger chunk size for sending
-                            if not chunk: break
-                            conn.sendall(chunk)
-                            bytes_sent += len(chunk)
-                    print(f"Finished sending {bytes_sent} bytes.")
-                    # --- End Send Result ---
-
-                except (ConnectionAbortedError, ConnectionResetError, socket.timeout) as net_err:
-                     print(f"! Network Error for {addr} during action '{action}': {net_err}")
-                except FileNotFoundError as fnfe:
-                     print(f"! File Not Found Error for {addr} during action '{action}': {fnfe}")
-                     # Attempt to send specific error
-                     try:
-                         conn.sendall("error_file_not_found.bin".encode()); conn.recv(1024)
-                         conn.sendall(str(0).encode().ljust(16)); conn.recv(1024)
-                         conn.sendall(f"ERROR: File not found on server. {fnfe}".encode())
-                     except Exception as e_send: print(f"Failed to send file not found error to client: {e_send}")
-                except Exception as e:
-                    print(f"!!! Error processing request from {addr} for action '{action}': {e}")
-                    traceback.print_exc() # Print full traceback
-                    if not action_success: # Only send general error if action itself failed
+        try:
+            while True:
+                for key, _ in selector.select(timeout=IDLE_SWEEP_INTERVAL):
+                    sock = key.fileobj
+                    if sock is s:
+                        try: conn, addr = s.accept()
+                        except (BlockingIOError, ConnectionError): continue # Client gave up before we got to it
+                        conn.setblocking(True) # Workers use plain blocking I/O with timeouts
+                        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Small ACK/control messages go out immediately
+                        print(f"\n--- New connection from {addr} ---")
+                        park(conn, conn.makefile("rb", buffering=CONTROL_BUFFER_SIZE), addr) # One buffered reader per connection
+                    elif sock is wake_recv:
                         try:
-                            # Send general error signal
-                            conn.sendall("error_processing.bin".encode()); conn.recv(1024)
-                            conn.sendall(str(0).encode().ljust(16)); conn.recv(1024)
-                            error_msg_client = f"ERROR: Server failed during action '{action}'. Check server logs. Details: {str(e)[:200]}"
-                            conn.sendall(error_msg_client.encode())
-                        except Exception as e_send: print(f"Failed to send processing error to client: {e_send}")
-
-                finally:
-                    # --- Cleanup ---
-                    print("--- Cleaning up temporary files ---")
-                    paths_to_remove = [input_path, output_path]
-                    dirs_to_remove = [temp_dir_for_action]
-                    # Add specific merge cleanup path if action was merge
-                    if action == "merge" and received_zip_path and received_zip_path != input_path:
-                         paths_to_remove.append(received_zip_path)
-
-                    for path in paths_to_remove:
-                        if path and os.path.exists(path) and os.path.isfile(path):
-                            try: os.remove(path); print(f"Removed file: {path}")
-                            except OSError as e_rem: print(f"Warning: Error removing file {path}: {e_rem}")
-                    for dir_path in dirs_to_remove:
-                        if dir_path and os.path.exists(dir_path) and os.path.isdir(dir_path):
-                             try: shutil.rmtree(dir_path, ignore_errors=True); print(f"Removed directory: {dir_path}")
-                             except Exception as e_rem_dir: print(f"Warning: Error removing dir {dir_path}: {e_rem_dir}")
-                    # --- End Cleanup ---
-                    print(f"--- Connection with {addr} closed ---")
+                            while wake_recv.recv(4096): pass
+                        except BlockingIOError: pass
+                        while not returned.empty():
+                            conn, rfile, addr, keep_alive = returned.get()
+                            busy -= 1
+                            if keep_alive: park(conn, rfile, addr)
+                            else: close_connection(conn, rfile, addr)
+                    else: # A parked connection has a request (or EOF) waiting
+                        if answer_ping(sock): # Stays parked; the ping counts as activity
+                            idle[sock] = idle[sock][:2] + (time.monotonic(),)
+                            continue
+                        selector.unregister(sock)
+                        rfile, addr, _ = idle.pop(sock)
+                        busy += 1
+                        workers.submit(serve_ready_request, sock, rfile, addr, hand_back)
+
+                now = time.monotonic()
+                if now - last_sweep >= IDLE_SWEEP_INTERVAL:
+                    last_sweep = now
+                    for conn, (rfile, addr, parked_at) in list(idle.items()):
+                        if now - parked_at > IDLE_TIMEOUT:
+                            print(f"Closing idle connection from {addr}.")
+                            selector.unregister(conn); del idle[conn]
+                            close_connection(conn, rfile, addr)
+
+                # At the connection limit new clients wait in the listen backlog
+                if accepting and len(idle) + busy >= MAX_CONNECTIONS: selector.unregister(s); accepting = False
+                elif not accepting and len(idle) + busy < MAX_CONNECTIONS: selector.register(s, selectors.EVENT_READ); accepting = True
+        finally:
+            workers.shutdown(wait=False, cancel_futures=True)
+            for conn, (rfile, addr, _) in list(idle.items()): close_connection(conn, rfile, addr)
+            selector.close(); wake_recv.close(); wake_send.close()
 
 if __name__ == '__main__':
     try:
@@ -764,4 +1159,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         print("\nServer stopping manually.")
     finally:
+        if _office_pool: _office_pool.shutdown(wait=False, cancel_futures=True) # Workers quit their Office apps on exit
+        if _render_pool: _render_pool.shutdown(wait=False, cancel_futures=True)
+        if _action_pool: _action_pool.shutdown(wait=False, cancel_futures=True)
         print("Server stopped.")
\ No newline at end of file
@@ -0,0 +1,94 @@
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import server
+except ImportError as e: # Server dependencies (comtypes, PyMuPDF, ...) not installed
+    raise unittest.SkipTest(f"server dependencies unavailable: {e}")
+
+
+def recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk: raise ConnectionAbortedError("server closed the connection")
+        data += chunk
+    return data
+
+
+class KeepAliveTest(unittest.TestCase):
+    def setUp(self):
+        self.connect()
+
+    def connect(self):
+        """Opens a fresh TCP connection; the server side is self.conn/self.rfile, the client side self.client."""
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        self.client = socket.create_connection(listener.getsockname())
+        self.addCleanup(self.client.close)
+        self.conn, self.addr = listener.accept()
+        self.addCleanup(self.conn.close)
+        self.rfile = self.conn.makefile("rb", buffering=server.CONTROL_BUFFER_SIZE)
+        self.addCleanup(self.rfile.close)
+        self.client.settimeout(10.0)
+
+    def request(self, action, data=b"x", size=None):
+        """Serves one request on the server side of the connection; returns (keep_alive, name, size, payload).
+        size overrides the body size sent in the header (default: len(data))."""
+        result = {}
+        worker = threading.Thread(target=lambda *conn: result.setdefault("keep_alive", server.handle_request(*conn)),
+                                  args=(self.conn, self.rfile, self.addr))
+        worker.start()
+        header = json.dumps({"action": action, "filename": "in.pdf", "size": len(data) if size is None else size, "options": {}}).encode()
+        self.client.sendall(struct.pack("!I", len(header)) + header + data)
+        name = recv_exact(self.client, struct.unpack("!H", recv_exact(self.client, 2))[0]).decode()
+        result_size = struct.unpack("!Q", recv_exact(self.client, 8))[0]
+        payload = recv_exact(self.client, result_size)
+        worker.join(10.0)
+        return result.get("keep_alive"), name, result_size, payload
+
+    def wait_readable(self):
+        self.assertTrue(select.select([self.conn], [], [], 10.0)[0], "nothing arrived on the server side")
+
+    def test_empty_result_keeps_connection_usable(self):
+        handlers = {
+            "empty": lambda input_path, output_path, options, input_ext: open(output_path, "wb").close(),
+            "echo": lambda input_path, output_path, options, input_ext: server.shutil.copyfile(input_path, output_path),
+        }
+        with mock.patch.dict(server.ACTION_HANDLERS, handlers):
+            keep_alive, name, size, payload = self.request("empty")
+            self.assertTrue(keep_alive)
+            self.assertEqual((name, size, payload), ("in_empty.pdf", 0, b""))
+            keep_alive, name, size, payload = self.request("echo", b"second request")
+            self.assertTrue(keep_alive)
+            self.assertEqual((name, payload), ("in_echo.pdf", b"second request"))
+
+    def test_ping_is_answered_on_the_event_loop(self):
+        self.client.sendall(server.PING_REQUEST)
+        self.wait_readable()
+        self.assertTrue(server.answer_ping(self.conn))
+        self.assertEqual(recv_exact(self.client, len(server.PONG)), server.PONG)
+        self.client.sendall(server.control_frame("bye"))
+        self.wait_readable()
+        self.assertFalse(server.answer_ping(self.conn))
+        self.assertFalse(server.handle_request(self.conn, self.rfile, self.addr)) # The bye was left for the worker
+
+    def test_invalid_size_is_rejected_before_the_body(self):
+        for size in (-5, "12", 1.5, True):
+            with self.subTest(size=size):
+                self.connect()
+                keep_alive, name, reply_size, _ = self.request("compress", b"", size=size)
+                self.assertEqual((name, reply_size), ("error_bad_request.bin", 0))
+                self.assertFalse(keep_alive)
+
+
+if __name__ == "__main__":
+    unittest.main()